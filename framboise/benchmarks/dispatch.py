@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Benchmark of the Monitor dispatch path.
+
+idle:     CPU time used by N idle monitors with the blocking dispatch loop and
+          with the former 10 ms polling loop.
+classify: time to route a browser log through the listeners, once with the
+          combined trigger regex of Monitor.dispatch() and once by handing
+          every line to every listener as before. The log is synthetic unless
+          a captured one is given with -log.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framboise import AsanListener, Empty, Listener, Monitor, SyzyListener, TestcaseListener  # noqa: E402
+
+
+class PollingMonitor(Monitor):
+    """
+    The dispatch loop before the blocking queue: poll, sleep 10 ms when empty.
+    """
+
+    def run(self):
+        while True:
+            try:
+                line = self.line_queue.get_nowait()
+            except Empty:
+                time.sleep(0.01)
+                continue
+            if line is self.STOP:
+                break
+            self.dispatch(line.strip())
+
+
+def bench_idle(workers, duration):
+    results = []
+    for cls in (PollingMonitor, Monitor):
+        monitors = [cls() for _ in range(workers)]
+        for monitor in monitors:
+            monitor.daemon = True
+            monitor.start()
+        time.sleep(0.2)
+        start = time.process_time()
+        time.sleep(duration)
+        used = time.process_time() - start
+        for monitor in monitors:
+            monitor.stop()
+        for monitor in monitors:
+            monitor.join()
+        results.append((cls.__name__, used))
+    for name, used in results:
+        print('idle  {:<15} {:>3} monitors  {:8.4f} s CPU in {} s'.format(name, workers, used, duration))
+
+
+def synthetic_log(size, seed=0):
+    """
+    Lines resembling the console of a fuzzed browser: mostly noise, the
+    commands of each testcase and an ASan report at the end.
+    """
+    rng = random.Random(seed)
+    noise = [
+        'JavaScript error: http://localhost/index.html, line 1: TypeError: o is null',
+        '[Parent 1234, Main Thread] WARNING: NS_ENSURE_TRUE(mDocShell) failed: file nsDocShell.cpp, line 42',
+        'console.log: framboise: heartbeat',
+        '###!!! [Child][MessageChannel] Error: (msgtype=0x1,name=PContent::Msg_Foo) Channel closing',
+    ]
+    lines = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.01:
+            line = 'NEXT TESTCASE'
+        elif rng.random() < 0.6:
+            line = '/*L*/ ' + 'o{}.setAttribute("id", "{}");'.format(rng.randint(0, 99), rng.random())
+        else:
+            line = rng.choice(noise)
+        lines.append(line)
+        length += len(line) + 1
+    lines.append('==1==ERROR: AddressSanitizer: heap-use-after-free on address 0x6020 pc 0x7f bp 0x7f sp 0x7f')
+    lines.extend('    #{} 0x7f{:04x} in frame{} /src/file.cpp:{}'.format(i, i, i, i) for i in range(30))
+    return lines
+
+
+class PatternListener(Listener):
+    """
+    A listener which, like the built-in ones, checks its own pattern too.
+    """
+
+    def __init__(self, pattern):
+        self.PATTERNS = (pattern,)
+        super(PatternListener, self).__init__()
+        self.hits = 0
+
+    def process_line(self, line):
+        if line.find(self.PATTERNS[0]) != -1:
+            self.hits += 1
+
+
+def listeners(extra=0):
+    result = [TestcaseListener(), AsanListener(), SyzyListener()]
+    result.extend(PatternListener('PATTERN{}:'.format(i)) for i in range(extra))
+    return result
+
+
+def read_log(path):
+    with open(path, encoding='utf-8', errors='replace') as fo:
+        return [line.rstrip('\r\n') for line in fo]
+
+
+def bench_classify(lines, repeat, extra=0):
+    size = sum(len(line) + 1 for line in lines)
+
+    def every_listener():
+        targets = listeners(extra)
+        for line in lines:
+            for listener in targets:
+                listener.process_line(line)
+
+    def combined():
+        monitor = Monitor()
+        for listener in listeners(extra):
+            monitor.add_listener(listener)
+        for line in lines:
+            monitor.dispatch(line)
+
+    for name, run in (('every listener', every_listener), ('combined regex', combined)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('classify  {:<15} {:8.3f} s  {:8.1f} MB/s  ({} lines, {} listeners)'.format(
+            name, best, size / best / 1024 / 1024, len(lines), 3 + extra))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the Monitor dispatch path.')
+    parser.add_argument('mode', nargs='?', choices=('idle', 'classify', 'all'), default='all')
+    parser.add_argument('-workers', metavar='#', type=int, default=32,
+                        help='idle monitors to run')
+    parser.add_argument('-duration', metavar='#', type=float, default=3,
+                        help='seconds to measure idle CPU for')
+    parser.add_argument('-size', metavar='MB', type=float, default=16,
+                        help='size of the synthetic log')
+    parser.add_argument('-log', metavar='file',
+                        help='replay a captured browser log instead of a synthetic one')
+    parser.add_argument('-extra', metavar='#', type=int, nargs='+', default=[0, 9],
+                        help='listeners added to the three default ones, one run each')
+    parser.add_argument('-repeat', metavar='#', type=int, default=3,
+                        help='runs per path, the best one is reported')
+    args = parser.parse_args()
+
+    if args.mode in ('idle', 'all'):
+        bench_idle(args.workers, args.duration)
+    if args.mode in ('classify', 'all'):
+        lines = read_log(args.log) if args.log else synthetic_log(int(args.size * 1024 * 1024))
+        for extra in args.extra:
+            bench_classify(lines, args.repeat, extra)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Time to unmask one WebSocket frame payload with the former per-byte loop,
+the int.from_bytes path and the NumPy path of websocket.unmask().
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs.py import websocket  # noqa: E402
+
+SIZES = [100, 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+
+def byte_loop(data, mask):
+    return bytearray((b ^ mask[i % 4]) for (i, b) in enumerate(data))
+
+
+def int_path(data, mask):
+    numpy, websocket.numpy = websocket.numpy, None
+    try:
+        return websocket.unmask(data, mask)
+    finally:
+        websocket.numpy = numpy
+
+
+def numpy_path(data, mask):
+    # bytes as read from the socket, so this includes the copy to a writable array
+    return websocket.unmask(data, mask)
+
+
+def timeit(function, data, mask, budget):
+    """Best time of as many runs as fit into `budget` seconds, at least one."""
+    best = None
+    end_time = time.perf_counter() + budget
+    while best is None or time.perf_counter() < end_time:
+        start = time.perf_counter()
+        function(data, mask)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Unmasking speed per frame size.')
+    parser.add_argument('-size', metavar='#', type=int, nargs='+', default=SIZES,
+                        help='payload sizes in bytes')
+    parser.add_argument('-budget', metavar='#', type=float, default=0.5,
+                        help='seconds spent per size and path')
+    parser.add_argument('-loop-limit', dest='loop_limit', metavar='#', type=int, default=1024 * 1024,
+                        help='largest size to run the per-byte loop on')
+    args = parser.parse_args()
+
+    paths = [('byte loop', byte_loop), ('int', int_path)]
+    if websocket.numpy is not None:
+        paths.append(('numpy', numpy_path))
+    else:
+        print('NumPy is not installed, skipping its path.')
+    print('{:>10}  '.format('size') + '  '.join('{:>12}'.format(name) for name, _ in paths))
+    mask = bytearray(os.urandom(4))
+    for size in args.size:
+        data = os.urandom(size)
+        expected = bytes(byte_loop(data, mask)) if size <= args.loop_limit else None
+        cells = []
+        for name, function in paths:
+            if function is byte_loop and size > args.loop_limit:
+                cells.append('{:>12}'.format('-'))
+                continue
+            if expected is not None:
+                assert bytes(function(data, mask)) == expected, name
+            cells.append('{:>9.3f} ms'.format(timeit(function, data, mask, args.budget) * 1000))
+        print('{:>10}  '.format(size) + '  '.join(cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Throughput of the WebSocket monitor backends.
+
+Clients connect over loopback, send masked text frames like a browser does
+and close; a run ends once the server has received every message. The
+threaded backend is the socketserver handler WebSocketMonitor uses on
+Python 2, the asyncio backend the one it uses on Python 3.
+"""
+import argparse
+import base64
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from socketserver import TCPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs.py import aiowebsocket, websocket  # noqa: E402
+
+
+class Counter(object):
+
+    def __init__(self, total):
+        self.total = total
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def add(self):
+        with self.lock:
+            self.count += 1
+            if self.count >= self.total:
+                self.done.set()
+
+
+def client_frame(payload):
+    """A masked text frame as sent by browsers."""
+    mask = os.urandom(4)
+    header = bytearray([0x81])
+    if len(payload) <= 125:
+        header.append(0x80 | len(payload))
+    elif len(payload) <= 65535:
+        header.append(0x80 | 126)
+        header.extend(struct.pack('!H', len(payload)))
+    else:
+        header.append(0x80 | 127)
+        header.extend(struct.pack('!Q', len(payload)))
+    masked = bytes(bytearray(b ^ mask[i % 4] for i, b in enumerate(bytearray(payload))))
+    return bytes(header) + mask + masked
+
+
+def run_client(port, frame, messages):
+    try:
+        send_messages(port, frame, messages)
+    except (IOError, OSError):
+        pass  # the server gave up on the run
+
+
+def send_messages(port, frame, messages):
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        sock.sendall('GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     'Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n'.format(key).encode('ascii'))
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = sock.recv(1024)
+            if not chunk:
+                return
+            response += chunk
+        batch = max(1, 65536 // len(frame))
+        sent = 0
+        while sent < messages:
+            count = min(batch, messages - sent)
+            sock.sendall(frame * count)
+            sent += count
+        sock.sendall(b'\x88\x80' + os.urandom(4))  # close
+    finally:
+        sock.close()
+
+
+def threaded_server(counter):
+    class Handler(websocket.BaseWebSocketHandler):
+        def on_message(self, message):
+            counter.add()
+
+    class _TCPServer(TCPServer):
+        allow_reuse_address = True
+
+    return _TCPServer(('127.0.0.1', 0), Handler)
+
+
+def asyncio_server(counter):
+    class Handler(aiowebsocket.AsyncWebSocketHandler):
+        def on_message(self, message):
+            counter.add()
+
+    return aiowebsocket.AsyncWebSocketServer(('127.0.0.1', 0), Handler)
+
+
+def bench(name, factory, connections, messages, size, timeout):
+    counter = Counter(connections * messages)
+    server = factory(counter)
+    port = server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    frame = client_frame(b'x' * size)
+    start = time.time()
+    clients = [threading.Thread(target=run_client, args=(port, frame, messages)) for _ in range(connections)]
+    for client in clients:
+        client.daemon = True
+        client.start()
+    finished = counter.done.wait(timeout)
+    elapsed = time.time() - start
+    server.shutdown()
+    received = counter.count
+    print('{:<9} {:>4} conn  {:>8} B  {:>10.0f} msg/s  {:>8.2f} MB/s  {}'.format(
+        name, connections, size, received / elapsed, received * size / elapsed / 1024 / 1024,
+        '' if finished else 'timed out, {} of {} messages'.format(received, counter.total)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the WebSocket monitor backends.')
+    parser.add_argument('-connections', metavar='#', type=int, nargs='+', default=[1, 200],
+                        help='concurrent connections per run')
+    parser.add_argument('-messages', metavar='#', type=int, default=2000,
+                        help='messages per connection at 100 B, fewer for larger payloads')
+    parser.add_argument('-size', metavar='#', type=int, nargs='+', default=[100, 65536],
+                        help='payload bytes per message')
+    parser.add_argument('-timeout', metavar='#', type=float, default=60,
+                        help='seconds before a run is given up')
+    args = parser.parse_args()
+
+    for size in args.size:
+        for connections in args.connections:
+            messages = max(1, args.messages * 100 // max(size, 100))
+            bench('threaded', threaded_server, connections, messages, size, args.timeout)
+            bench('asyncio', asyncio_server, connections, messages, size, args.timeout)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,16 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import argparse
+import copy
+import functools
+import hashlib
+import io
 import logging
 import multiprocessing
 import os
+import re
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
@@ -15,20 +21,50 @@ import threading
 import time
 import json
 from libs.py import websocket
+from libs.py.artifactstore import ArtifactStore
+from libs.py.assetserver import AssetServer
+from libs.py.differential import DifferentialComparator
+from libs.py.displays import DisplayPool
+from libs.py.generator import BatchFanout, CommandGenerator, GeneratorError
+from libs.py.limits import ResourceLimits
+from libs.py.reducer import Reducer
+from libs.py.scheduler import ModuleScheduler
+from libs.py.signatures import SignatureIndex, crash_signature
+from libs.py.stats import StatsAggregator, registry as stats
+from libs.py.spillbuffer import SpillBuffer
+from libs.py.submitqueue import SubmissionQueue
+from libs.py.testcase import parse_commands, write_commands, write_html
+try:
+    from libs.py import aiowebsocket
+except (ImportError, SyntaxError) as e:
+    # Python 2
+    aiowebsocket = None
 
 try:
     # Python 3
-    from queue import Queue, Empty
+    from queue import Empty, Queue
     from urllib.parse import urlencode, urljoin, unquote
     from socketserver import TCPServer
     from urllib.request import pathname2url
 except ImportError as e:
     # Python 2
-    from Queue import Queue, Empty
+    from Queue import Empty, Queue
     from urllib import urlencode
     from urlparse import unquote, urljoin
     from SocketServer import TCPServer
     from urllib import pathname2url
+try:
+    # Python 3
+    from multiprocessing.connection import wait as wait_for_processes
+except ImportError as e:
+    # Python 2
+    wait_for_processes = None
+try:
+    # Python 3
+    from subprocess import TimeoutExpired
+except ImportError as e:
+    # Python 2: subprocesses take neither timeout nor start_new_session
+    TimeoutExpired = None
 try:
     import yaml
 except ImportError as e:
@@ -40,6 +76,13 @@ VERSION = "17.03.14"
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
 
+def subprocess_timeout(seconds):
+    """
+    Keyword arguments which limit a subprocess call to `seconds` where supported.
+    """
+    return {'timeout': seconds} if TimeoutExpired is not None else {}
+
+
 class MonitorException(Exception):
     """
     Unrecoverable error in external process.
@@ -64,8 +107,19 @@ class PluginException(Exception):
 class Listener(object):
     """
     An abstract class for providing base methods and properties to listeners.
+
+    PATTERNS lists the substrings a line must contain for process_line() to be
+    called; None subscribes to every line. Once process_line() sets
+    `wants_all_lines`, e.g. because a crash log has started, the monitor hands
+    every following line to the listener.
     """
 
+    PATTERNS = None
+
+    def __init__(self):
+        self.wants_all_lines = self.PATTERNS is None
+        self.monitor = None
+
     @classmethod
     def name(cls):
         return getattr(cls, 'LISTENER_NAME', cls.__name__)
@@ -83,17 +137,25 @@ class Listener(object):
 class TestcaseListener(Listener):
 
     LISTENER_NAME = 'TestcaseListener'
+    PATTERNS = ('NEXT TESTCASE', '/*L*/ ')
 
-    def __init__(self, *args):
-        super(TestcaseListener, self).__init__(*args)
-        self.testcase = []
+    def __init__(self, max_memory=8 * 1024 * 1024):
+        super(TestcaseListener, self).__init__()
+        self.testcase = SpillBuffer(max_memory=max_memory)
+        self.started = None
 
     def process_line(self, line):
         if line.find('NEXT TESTCASE') != -1:
-            self.testcase = []
+            self.testcase.clear()
+            now = time.time()
+            stats.inc('testcases_total')
+            if self.started is not None:
+                stats.observe('testcase_seconds', now - self.started)
+            self.started = now
         if line.startswith('/*L*/ '):
             #self.testcase.append(json.loads(line[5:]))
             self.testcase.append(line[5:])
+            stats.inc('commands_total')
 
     def detected_fault(self):
         return True
@@ -101,7 +163,7 @@ class TestcaseListener(Listener):
     def get_data(self, bucket):
         if self.testcase:
             bucket['testcase'] = {
-                'data': os.linesep.join(self.testcase),
+                'data': self.testcase,
                 'name': 'testcase.txt'
             }
 
@@ -109,41 +171,57 @@ class TestcaseListener(Listener):
 class AsanListener(Listener):
 
     LISTENER_NAME = 'AsanListener'
+    PATTERNS = ('ERROR: AddressSanitizer',)
 
-    def __init__(self, *args):
-        super(AsanListener, self).__init__(*args)
-        self.crashlog = []
+    def __init__(self, max_memory=8 * 1024 * 1024):
+        super(AsanListener, self).__init__()
+        self.crashlog = SpillBuffer(max_memory=max_memory)
         self.failure = False
+        self.signatures = {}
 
     def process_line(self, line):
         if line.find('ERROR: AddressSanitizer') != -1:
             self.failure = True
+            self.wants_all_lines = True
         if self.failure:
             self.crashlog.append(line)
+            self.signatures.clear()
 
     def detected_fault(self):
         return self.failure
 
+    def signature(self, frames=5):
+        """
+        Return (signature, description) of the crashlog, computed once per
+        number of frames.
+        """
+        if frames not in self.signatures:
+            self.signatures[frames] = crash_signature(self.crashlog.iter_lines(), frames)
+        return self.signatures[frames]
+
     def get_data(self, bucket):
         if self.crashlog:
             bucket['crashlog'] = {
-                'data': os.linesep.join(self.crashlog),
-                'name': 'crashlog.txt'
+                'data': self.crashlog,
+                'name': 'crashlog.txt',
+                'signature': self.signature
             }
 
 
 class SyzyListener(Listener):
 
     LISTENER = 'SyzyAsanListener'
+    PATTERNS = ('SyzyASAN error:',)
 
-    def __init__(self, *args):
-        super(SyzyListener, self).__init__(*args)
-        self.crashlog = []
+    def __init__(self, max_memory=8 * 1024 * 1024):
+        super(SyzyListener, self).__init__()
+        self.crashlog = SpillBuffer(max_memory=max_memory)
         self.failure = False
 
     def process_line(self, line):
         if line.find('SyzyASAN error:') != -1:
             self.failure = True
+            self.wants_all_lines = True
         if self.failure:
             self.crashlog.append(line)
 
@@ -153,21 +231,169 @@ class SyzyListener(Listener):
     def get_data(self, bucket):
         if self.crashlog:
             bucket['crashlog'] = {
-                'data': os.linesep.join(self.crashlog),
+                'data': self.crashlog,
                 'name': 'crashlog.txt'
             }
 
 
+class SessionListener(Listener):
+    """
+    Drives testcase boundaries of a long-lived browser in session mode.
+
+    runtime.js reports the end of each testcase over the WebSocket and waits
+    for 'NEXT' before it reloads; no reply is sent once the session is due to be
+    recycled.
+    """
+
+    LISTENER_NAME = 'SessionListener'
+    PATTERNS = ('/*S*/ ',)
+
+    def __init__(self, session):
+        super(SessionListener, self).__init__()
+        self.session = session
+
+    def process_line(self, line):
+        if line.find('END TESTCASE') != -1:
+            if self.session.finished_testcase():
+                self.monitor.send('NEXT')
+
+
+class WatchdogListener(Listener):
+    """
+    Tracks the heartbeats and testcase markers which runtime.js sends over the
+    WebSocket, so that a wedged but still running target can be detected.
+    """
+
+    LISTENER_NAME = 'WatchdogListener'
+    PATTERNS = ('/*H*/ ', 'NEXT TESTCASE')
+
+    def __init__(self):
+        super(WatchdogListener, self).__init__()
+        self.last_seen = None
+
+    def process_line(self, line):
+        self.last_seen = time.time()
+
+    def gap(self):
+        """
+        Seconds since the last sign of life; 0 until the page first reported in.
+        """
+        if self.last_seen is None:
+            return 0
+        return time.time() - self.last_seen
+
+
+class BatchListener(Listener):
+    """
+    Answers the batch requests of a page running in pregenerated mode with the
+    next testcase from the CommandGenerator, from a thread of its own.
+    """
+
+    LISTENER_NAME = 'BatchListener'
+    PATTERNS = ('/*G*/ ',)
+    TIMEOUT = 60
+
+    def __init__(self, generator):
+        super(BatchListener, self).__init__()
+        self.generator = generator
+
+    def process_line(self, line):
+        if line.find('/*G*/ BATCH') == -1:
+            return
+        # Waiting for the generator on the dispatch thread would starve the
+        # watchdog and the other listeners of lines.
+        thread = threading.Thread(target=self.answer, name='BatchListener')
+        thread.daemon = True
+        thread.start()
+
+    def answer(self):
+        start = time.time()
+        try:
+            batch = self.generator.next(timeout=self.TIMEOUT)
+        except (Empty, GeneratorError) as e:
+            logging.error('No pregenerated testcase available: {}'.format(e or 'timeout'))
+            return
+        stats.observe('batch_wait_seconds', time.time() - start)
+        self.monitor.send('BATCH ' + json.dumps(batch))
+
+
+class AdaptiveListener(Listener):
+    """
+    Feeds the per-module reports of runtime.js into the ModuleScheduler and
+    pushes new weights to the page, and to the generator in pregenerated
+    mode, every INTERVAL testcases.
+    """
+
+    LISTENER_NAME = 'AdaptiveListener'
+    PATTERNS = ('/*W*/ ',)
+    INTERVAL = 50
+
+    def __init__(self, scheduler, generator=None):
+        super(AdaptiveListener, self).__init__()
+        self.scheduler = scheduler
+        self.generator = generator
+
+    def process_line(self, line):
+        try:
+            report = json.loads(line[line.find('/*W*/ ') + 6:])
+        except ValueError:
+            return
+        self.scheduler.record_testcase(report)
+        if self.scheduler.testcases % self.INTERVAL:
+            return
+        weights = self.scheduler.update()
+        for name, weight in weights.items():
+            stats.set('module_weight', weight, module=name)
+        if self.generator is not None:
+            self.generator.weights = weights
+        self.monitor.send('WEIGHTS ' + json.dumps(weights))
+
+
+class DifferentialListener(Listener):
+    """
+    Reports the exceptions a target raised for each pregenerated batch to the
+    DifferentialComparator.
+    """
+
+    LISTENER_NAME = 'DifferentialListener'
+    PATTERNS = ('/*W*/ ',)
+
+    def __init__(self, comparator, index):
+        super(DifferentialListener, self).__init__()
+        self.comparator = comparator
+        self.index = index
+
+    def process_line(self, line):
+        try:
+            report = json.loads(line[line.find('/*W*/ ') + 6:])
+        except ValueError:
+            return
+        if report.get('seed') is None:
+            return
+        errors = set()
+        for messages in report.get('errors', {}).values():
+            errors.update(messages)
+        self.comparator.record(self.index, report['seed'], errors)
+
+
 class Monitor(threading.Thread):
     """
     An abstract class for providing base methods and properties to monitors.
     """
 
+    # Sentinel which wakes up the blocking dispatch loop in run().
+    STOP = object()
+    # Lines between two updates of the line and queue depth metrics.
+    STATS_INTERVAL = 1000
+
     def __init__(self, verbose=False):
         super(Monitor, self).__init__()
         self.verbose = verbose
         self.listeners = []
         self.line_queue = Queue()
+        self.pattern = None
+        self.routes = {}
+        self.capturing = []
 
     @classmethod
     def name(cls):
@@ -178,30 +404,78 @@ class Monitor(threading.Thread):
         line_consumer.daemon = True
         line_consumer.start()
 
+        lines = 0
         while True:
-            try:
-                line = self.line_queue.get_nowait()
-            except Empty:
-                time.sleep(0.01)
-                continue
+            line = self.line_queue.get()
+            if line is self.STOP:
+                break
+
+            lines += 1
+            if lines % self.STATS_INTERVAL == 0 or self.line_queue.empty():
+                stats.inc('lines_total', lines, monitor=self.name())
+                stats.set('monitor_queue_depth', self.line_queue.qsize(), monitor=self.name())
+                lines = 0
 
             line = line.strip()
 
             if self.verbose:
                 print(line)
 
-            for listener in self.listeners:
-                listener.process_line(line)
+            self.dispatch(line)
 
     def enqueue_lines(self):
         pass
 
     def stop(self):
+        self.line_queue.put(self.STOP)
+
+    def send(self, message):
         pass
 
     def add_listener(self, listener):
         assert isinstance(listener, Listener)
+        listener.monitor = self
         self.listeners.append(listener)
+        self.compile_patterns()
+
+    def compile_patterns(self):
+        """
+        Combine the trigger patterns of all listeners into a single regex.
+        """
+        self.routes = {}
+        self.capturing = [l for l in self.listeners if l.wants_all_lines]
+        for listener in self.listeners:
+            for pattern in listener.PATTERNS or ():
+                self.routes.setdefault(pattern, []).append(listener)
+        if not self.routes:
+            self.pattern = None
+            return
+        # Longest first, so a pattern is never shadowed by one of its prefixes.
+        patterns = sorted(self.routes, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(re.escape(p) for p in patterns))
+
+    def dispatch(self, line):
+        """
+        Classify a line in one pass and hand it to the interested listeners only.
+        """
+        for listener in self.capturing:
+            listener.process_line(line)
+        if self.pattern is None:
+            return
+        matches = self.pattern.findall(line)
+        if not matches:
+            return
+        listeners = self.routes[matches[0]]
+        if len(matches) > 1:
+            listeners = list(listeners)
+            for match in matches[1:]:
+                listeners.extend(l for l in self.routes[match] if l not in listeners)
+        for listener in listeners:
+            if listener in self.capturing:
+                continue
+            listener.process_line(line)
+            if listener.wants_all_lines:
+                self.capturing.append(listener)
 
     def detected_fault(self):
         return any(listener.detected_fault() for listener in self.listeners)
@@ -226,6 +500,16 @@ class ConsoleMonitor(Monitor):
             self.line_queue.put(line)
         self.out.close()
 
+    def drain(self, timeout=5):
+        """
+        Stop once the output of the exited process was read and dispatched.
+        """
+        end_time = time.time() + timeout
+        while not self.out.closed and time.time() < end_time:
+            time.sleep(0.05)
+        self.stop()
+        self.join(timeout)
+
 
 class WebSocketMonitor(Monitor):
 
@@ -235,12 +519,29 @@ class WebSocketMonitor(Monitor):
         super(WebSocketMonitor, self).__init__(*args, **kwargs)
         self.addr_port = addr_port
         self.server = None
+        self.connection = None
 
     def enqueue_lines(self):
         run = True
         line_queue = self.line_queue
+        monitor = self
+
+        if aiowebsocket is not None:
+            class AsyncWebSocketHandler(aiowebsocket.AsyncWebSocketHandler):
+                def open(self):
+                    monitor.connection = self
+
+                def on_message(self, message):
+                    line_queue.put(message)
+
+            self.server = aiowebsocket.AsyncWebSocketServer(self.addr_port, AsyncWebSocketHandler)
+            self.server.serve_forever()
+            return
 
         class WebSocketHandler(websocket.BaseWebSocketHandler):
+            def open(self):
+                monitor.connection = self
+
             def on_message(self, message):
                 line_queue.put(message)
 
@@ -256,12 +557,29 @@ class WebSocketMonitor(Monitor):
         finally:
             run = False
 
+    def send(self, message):
+        """
+        Send a message to the most recently connected page.
+        """
+        connection = self.connection
+        if connection is None:
+            return
+        try:
+            if aiowebsocket is not None:
+                self.server.loop.call_soon_threadsafe(connection.write_message, message)
+            else:
+                connection.write_message(message)
+        except (RuntimeError, IOError, OSError) as e:
+            # The server was shut down while the page was still talking to us.
+            logging.debug('Unable to send {!r}: {}'.format(message, e))
+
     def stop(self):
         if self.server:
             try:
                 self.server.shutdown()
             except Exception as e:
                 logging.exception(e)
+        super(WebSocketMonitor, self).stop()
 
 
 class BasePlugin(object):
@@ -287,10 +605,25 @@ class BasePlugin(object):
 class ExternalProcess(BasePlugin):
     """
     Parent class for plugins which make use of external tools.
+
+    Targets are started in their own session, so that stop() can take down
+    everything they spawned, e.g. content processes or the Xvfb of xvfb-run,
+    and not only the top-level process.
     """
 
+    # Seconds between SIGTERM and SIGKILL when stopping a target.
+    GRACE_PERIOD = 5
+    # Seconds between snapshots of the process tree while waiting for a target.
+    TRACK_INTERVAL = 5
+
     def __init__(self):
         self.process = None
+        self.limits = None
+        self.display = None
+        self.stopped = False
+        self.tree = {}
+        self.tracked = 0
+        self.leader_start = None
 
     @staticmethod
     def which(program_name):
@@ -302,8 +635,15 @@ class ExternalProcess(BasePlugin):
 
     def open(self, cmd, env=None, cwd=None):
         logging.info('Running command: {}'.format(cmd))
+        stats.inc('target_launches_total', plugin=self.name())
         if env is None:
             env = os.environ
+        if self.limits is not None:
+            self.limits.prepare()
+            cmd = self.limits.wrap(cmd)
+        session = {}
+        if 'posix' in sys.builtin_module_names:
+            session = {'start_new_session': True} if TimeoutExpired is not None else {'preexec_fn': os.setsid}
         self.process = subprocess.Popen(
             cmd,
             universal_newlines=True,
@@ -312,7 +652,10 @@ class ExternalProcess(BasePlugin):
             stderr=subprocess.STDOUT,
             stdout=subprocess.PIPE,
             bufsize=1,
-            close_fds='posix' in sys.builtin_module_names)
+            close_fds='posix' in sys.builtin_module_names,
+            **session)
+        stat = self.proc_stat(self.process.pid)
+        self.leader_start = stat[3] if stat else None
         return self.process
 
     @staticmethod
@@ -321,22 +664,53 @@ class ExternalProcess(BasePlugin):
         return subprocess.check_call(cmd, env=env, cwd=cwd)
 
     def wait(self, timeout=600):
-        if timeout:
-            end_time = time.time() + timeout
-            interval = min(timeout / 1000.0, .25)
-            while True:
-                result = self.process.poll()
-                if result is not None:
-                    return result
-                if time.time() >= end_time:
-                    break
-                time.sleep(interval)
-            self.stop()
+        end_time = time.time() + timeout if timeout else None
+        interval = min(timeout / 1000.0, .25) if timeout else .25
+        while True:
+            result = self.process.poll()
+            if result is not None:
+                return result
+            if end_time is not None and time.time() >= end_time:
+                break
+            self.track()
+            time.sleep(interval)
+        self.stop()
         self.process.wait()
 
-    @staticmethod
-    def setup_environ(context=None):
-        env = os.environ
+    def memory_usage(self):
+        """
+        Resident set size of the target process in bytes, None if unknown.
+        """
+        try:
+            with open('/proc/{}/statm'.format(self.process.pid)) as fo:
+                return int(fo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (IOError, OSError, ValueError, AttributeError):
+            return None
+
+    def stack_sample(self):
+        """
+        Stack traces of all threads of the target, via eu-stack or gdb if present.
+        """
+        pid = str(self.process.pid)
+        tools = [
+            ['eu-stack', '-p', pid],
+            ['gdb', '-p', pid, '-batch', '-ex', 'thread apply all bt'],
+        ]
+        for cmd in tools:
+            if not self.which(cmd[0]):
+                continue
+            try:
+                return subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True,
+                                               **subprocess_timeout(60))
+            except Exception as e:
+                logging.error('{} failed: {}'.format(cmd[0], e))
+        return None
+
+    def setup_environ(self, context=None):
+        # A copy per launch; targets of several setups may share the process.
+        env = dict(os.environ)
+        if self.display is not None:
+            env['DISPLAY'] = self.display
         if context is None:
             return env
         for key, val in context.items():
@@ -346,13 +720,138 @@ class ExternalProcess(BasePlugin):
                 env[key] = val
         return env
 
+    @staticmethod
+    def proc_stat(pid):
+        """
+        Return (state, ppid, session, start time) of a process from /proc, None
+        if it is gone.
+        """
+        try:
+            with open('/proc/{}/stat'.format(pid)) as fo:
+                stat = fo.read()
+        except (IOError, OSError):
+            return None
+        # Fields after the command name: state, ppid, pgrp, session, ...
+        fields = stat[stat.rfind(')') + 2:].split()
+        return fields[0], int(fields[1]), int(fields[3]), fields[19]
+
+    def owns_session(self):
+        """
+        Whether the session and process group named after the target's PID are
+        still ours. The kernel keeps a PID that is in use as a session ID, so
+        they are unless another process runs under that PID now.
+        """
+        stat = self.proc_stat(self.process.pid)
+        return stat is None or stat[3] == self.leader_start
+
+    def process_tree(self):
+        """
+        Return {pid: start time} of the live processes in the session of the
+        target and of its descendants which left it; empty without /proc.
+
+        Descendants which left the session are only found while their parent
+        lives, so track() records the tree from the wait loops.
+        """
+        if not self.owns_session():
+            return {}
+        sid = self.process.pid
+        procs = {}
+        members = set()
+        for name in os.listdir('/proc') if os.path.isdir('/proc') else []:
+            if not name.isdigit():
+                continue
+            stat = self.proc_stat(name)
+            if stat is None or stat[0] == 'Z':
+                continue
+            procs[int(name)] = stat
+            if stat[2] == sid:
+                members.add(int(name))
+        members.add(sid)
+        while True:
+            children = set(pid for pid, stat in procs.items() if stat[1] in members) - members
+            if not children:
+                break
+            members.update(children)
+        members.discard(os.getpid())
+        return dict((pid, procs[pid][3]) for pid in members if pid in procs)
+
+    def track(self):
+        if time.time() - self.tracked >= self.TRACK_INTERVAL:
+            self.tracked = time.time()
+            self.tree.update(self.process_tree())
+
+    def alive(self, tree):
+        """
+        Return the processes of `tree` which still run; a matching start time
+        makes sure that a PID was not reused meanwhile.
+        """
+        result = {}
+        for pid, start in tree.items():
+            stat = self.proc_stat(pid)
+            if stat is not None and stat[0] != 'Z' and stat[3] == start:
+                result[pid] = start
+        return result
+
+    def signal_tree(self, tree, signum):
+        if self.owns_session():
+            try:
+                os.killpg(self.process.pid, signum)
+            except OSError:
+                pass  # group is gone
+        for pid in tree:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def kill_tree(self, grace_period=None):
+        """
+        Send SIGTERM to the target and everything it spawned, SIGKILL to what
+        is left after the grace period and reap the target. Returns the number
+        of processes which were still running after the grace period.
+        """
+        if grace_period is None:
+            grace_period = self.GRACE_PERIOD
+        if 'posix' not in sys.builtin_module_names:
+            self.process.terminate()
+            self.process.kill()
+            self.process.wait()
+            return 0
+        end_time = time.time() + grace_period
+        self.tree = self.alive(self.tree)
+        self.tree.update(self.process_tree())
+        self.signal_tree(self.tree, signal.SIGTERM)
+        while self.process.poll() is None and time.time() < end_time:
+            time.sleep(0.05)
+        remaining = self.alive(self.tree)
+        spawned = dict((pid, start) for pid, start in self.process_tree().items() if pid not in remaining)
+        if spawned:
+            # Started after the snapshot above.
+            self.signal_tree(spawned, signal.SIGTERM)
+            remaining.update(spawned)
+        remaining.pop(self.process.pid, None)
+        # Children which are still exiting do not count as leaked.
+        while remaining and time.time() < end_time:
+            time.sleep(0.05)
+            remaining = self.alive(remaining)
+        if remaining:
+            logging.warning('Killing {} processes which ignored SIGTERM.'.format(len(remaining)))
+            self.signal_tree(remaining, signal.SIGKILL)
+        self.process.wait()
+        return len(remaining)
+
     def stop(self):
-        if self.process:
+        if self.process and not self.stopped:
+            self.stopped = True
             try:
-                self.process.terminate()
-                self.process.kill()
+                leaked = self.kill_tree()
             except Exception as e:
                 logging.error(e)
+                return
+            stats.set('leaked_processes', leaked, plugin=self.name())
+            if leaked:
+                logging.info('Killed {} processes left behind by the target.'.format(leaked))
+                stats.inc('leaked_processes_total', leaked, plugin=self.name())
 
     def build_path(self, path):
         return os.path.expandvars(os.path.expanduser(path))
@@ -379,6 +878,104 @@ class DefaultPlugin(ExternalProcess):
         self.process = self.open(cmd, self.setup_environ(environment))
 
 
+class ProfileCache(object):
+    """
+    One Firefox template profile per (application, preferences) pair.
+
+    The template is created with -CreateProfile once and each run gets a cheap
+    copy of it. A stamp file records the binary and preferences the template was
+    built from, so that it is rebuilt when either of them changes.
+    """
+
+    ROOT = os.path.join(tempfile.gettempdir(), 'framboise_profiles')
+    STAMP = 'framboise.stamp.json'
+
+    def __init__(self, application, preferences, environ=None):
+        self.application = os.path.realpath(application)
+        self.preferences = os.path.realpath(preferences)
+        self.environ = environ
+        key = hashlib.sha1('{}\0{}'.format(self.application, self.preferences).encode('UTF-8')).hexdigest()
+        self.template_folder = os.path.join(self.ROOT, key[:16])
+
+    def stamp(self):
+        binary = os.stat(self.application)
+        with open(self.preferences, 'rb') as fo:
+            prefs = hashlib.sha1(fo.read()).hexdigest()
+        return {
+            'application': [binary.st_size, int(binary.st_mtime)],
+            'preferences': prefs,
+        }
+
+    def _read_stamp(self):
+        try:
+            with open(os.path.join(self.template_folder, self.STAMP)) as fo:
+                return json.load(fo)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def template(self):
+        """
+        Return the template folder and its build time, (re)building it if stale.
+        """
+        stamp = self.stamp()
+        cached = self._read_stamp()
+        if cached is not None and all(cached.get(k) == v for k, v in stamp.items()):
+            return self.template_folder, cached['build_time']
+        if os.path.isdir(self.template_folder):
+            logging.info('Profile template {} is outdated, rebuilding.'.format(self.template_folder))
+            self._discard(self.template_folder)
+
+        if not os.path.isdir(self.ROOT):
+            try:
+                os.makedirs(self.ROOT)
+            except OSError:
+                pass  # created by another worker
+        staging = tempfile.mkdtemp(dir=self.ROOT)
+        start = time.time()
+        cmd = [
+            self.application,
+            '-no-remote',
+            '-CreateProfile',
+            '{} {}'.format(os.path.basename(staging), staging)
+        ]
+        ExternalProcess.call(cmd, self.environ)
+        shutil.copyfile(self.preferences, os.path.join(staging, 'user.js'))
+        stamp['build_time'] = time.time() - start
+        with open(os.path.join(staging, self.STAMP), 'w') as fo:
+            json.dump(stamp, fo)
+        try:
+            os.rename(staging, self.template_folder)
+        except OSError:
+            # Another worker won the race, use its template.
+            self._discard(staging)
+        logging.info('Built profile template {} in {:.2f}s.'.format(self.template_folder, stamp['build_time']))
+        return self.template_folder, stamp['build_time']
+
+    @staticmethod
+    def _discard(folder):
+        trash = tempfile.mkdtemp(dir=os.path.dirname(folder))
+        try:
+            os.rename(folder, os.path.join(trash, 'profile'))
+        except OSError:
+            pass
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def checkout(self):
+        """
+        Copy the template into a fresh profile folder for a single run.
+        """
+        template, build_time = self.template()
+        start = time.time()
+        profile_folder = tempfile.mkdtemp(prefix='framboise_')
+        os.rmdir(profile_folder)
+        shutil.copytree(template, profile_folder)
+        os.remove(os.path.join(profile_folder, self.STAMP))
+        elapsed = time.time() - start
+        logging.info('Profile copied in {:.3f}s, saved {:.2f}s over -CreateProfile.'.format(
+            elapsed, build_time - elapsed))
+        return profile_folder
+
+
 class FirefoxPlugin(ExternalProcess):
 
     PLUGIN_NAME = 'Firefox'
@@ -397,34 +994,21 @@ class FirefoxPlugin(ExternalProcess):
         if not preferences or not os.path.exists(preferences):
             raise PluginException('{} not found.'.format(preferences))
 
-        self.profile_folder = tempfile.mkdtemp()
-        profile_name = os.path.basename(self.profile_folder)
-        cmd = [
-            application,
-            '-no-remote',
-            '-CreateProfile',
-            '{} {}'.format(profile_name, self.profile_folder)
-        ]
-        self.call(cmd, self.setup_environ(environment))
-        shutil.copyfile(preferences, os.path.join(self.profile_folder, 'user.js'))
+        profiles = ProfileCache(application, preferences, self.setup_environ(environment))
+        self.profile_folder = profiles.checkout()
 
-        cmd = [application, '-P', profile_name]
+        cmd = [application, '-profile', self.profile_folder]
         cmd.extend(arguments.split())
         cmd.append(self.target)
         self.process = self.open(cmd, self.setup_environ(environment))
 
     def stop(self):
+        super(FirefoxPlugin, self).stop()
         if os.path.isdir(self.profile_folder):
             try:
                 shutil.rmtree(self.profile_folder)
             except Exception as e:
                 logging.exception(e)
-        if self.process:
-            try:
-                self.process.terminate()
-                self.process.kill()
-            except Exception as e:
-                logging.error(e)
 
 
 class IexplorerPlugin(ExternalProcess):
@@ -452,8 +1036,14 @@ class IexplorerPlugin(ExternalProcess):
 class Logger(object):
     """
     Parent class for collecting buckets.
+
+    The 'data' of a bucket entry is either a string, bytes, a file object or a
+    re-iterable of str/bytes chunks such as a SpillBuffer. It is streamed to
+    disk in chunks so that large artifacts are never copied as a whole.
     """
 
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self):
         self.bucket = {}
 
@@ -463,6 +1053,29 @@ class Logger(object):
     def add_fault(self):
         pass
 
+    @classmethod
+    def iter_chunks(cls, data):
+        if isinstance(data, bytes):
+            yield data
+        elif isinstance(data, str):
+            for i in range(0, len(data), cls.CHUNK_SIZE):
+                yield data[i:i + cls.CHUNK_SIZE].encode('UTF-8')
+        elif hasattr(data, 'read'):
+            data.seek(0)
+            while True:
+                chunk = data.read(cls.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk.encode('UTF-8') if isinstance(chunk, str) else chunk
+        else:
+            for chunk in data:
+                yield chunk.encode('UTF-8') if isinstance(chunk, str) else chunk
+
+    def write_data(self, filename, data):
+        with open(filename, 'wb') as fo:
+            for chunk in self.iter_chunks(data):
+                fo.write(chunk)
+
     def build_path(self, path):
         return os.path.expandvars(os.path.expanduser(path))
 
@@ -473,15 +1086,61 @@ class Logger(object):
 class FuzzManagerLogger(Logger):
     """
     Bucket class to send crash information to FuzzManager
+
+    Crashes are deduplicated against a host-wide signature index first, so that
+    known ASan crashes are not submitted over and over again. New crashes are
+    spooled to an on-disk queue which a background thread submits in batches;
+    entries which finally fail to upload give their submission back. Hangs and
+    OOM kills have no crash data and are left to the FilesystemLogger.
     """
 
     def __init__(self, **kwargs):
         super(FuzzManagerLogger, self).__init__()
+        self.signature_db = '~/.framboise/signatures.sqlite'
+        self.signature_frames = 5
+        self.max_submissions = 1
+        self.resubmit_interval = None
+        self.queue_path = '~/.framboise/fuzzmanager-queue'
+        self.batch_size = 10
+        self.max_retries = 5
         self.__dict__.update(kwargs)
+        self.queue = SubmissionQueue.instance(self.build_path(self.queue_path), self.submit,
+                                              batch_size=self.batch_size, max_retries=self.max_retries,
+                                              on_failed=self.release)
+        self.signature = None
+        self.signatures = None
+        if self.signature_db:
+            self.signatures = SignatureIndex(self.build_path(self.signature_db),
+                                             max_submissions=self.max_submissions,
+                                             resubmit_interval=self.resubmit_interval)
+
+    def is_duplicate(self):
+        self.signature = None
+        crashlog = self.bucket.get('crashlog', {})
+        if self.signatures is None or 'signature' not in crashlog:
+            return False
+        signature, description = crashlog['signature'](self.signature_frames)
+        if signature is None:
+            return False
+        hits, submit = self.signatures.record(signature, description)
+        if not submit:
+            logging.info('Skipping known crash ({} hits): {}'.format(hits, description))
+        else:
+            self.signature = signature
+        return not submit
 
     def add_fault(self):
-        testcase = crashdata = ""
-        logdir = tempfile.TemporaryDirectory()
+        if 'oom' in self.bucket:
+            logging.info('Not submitting OOM kill to FuzzManager.')
+            return
+        if 'hang' in self.bucket:
+            logging.info('Not submitting hang to FuzzManager.')
+            return
+        if self.is_duplicate():
+            return
+
+        entry = self.queue.reserve()
+        files = {}
 
         for name, meta in self.bucket.items():
             if 'data' not in meta or not meta['data']:
@@ -491,65 +1150,141 @@ class FuzzManagerLogger(Logger):
                 logging.error('Bucket "{}" does not contain "name" field or field is empty.'.format(name))
                 continue
 
-            filename = os.path.join(logdir.name, meta['name'])
-
             try:
-                with open(filename, 'wb') as fo:
-                    fo.write(meta['data'].encode('UTF-8'))
+                self.write_data(os.path.join(entry, meta['name']), meta['data'])
             except IOError as e:
                 logging.exception(e)
+                continue
+
+            if "testcase.txt" in meta['name']:
+                files['testcase'] = meta['name']
+            if "crashlog.txt" in meta['name']:
+                files['crashdata'] = meta['name']
 
-            if "testcase.txt" in filename:
-                testcase = filename
-            if "crashlog.txt" in filename:
-                crashdata = filename
+        if self.signature is not None:
+            files.update(signature=self.signature, signature_db=self.build_path(self.signature_db))
+        self.queue.put(entry, dict(files,
+                                   collector_script=os.path.abspath(self.build_path(self.collector_script)),
+                                   binary=self.binary))
+        logging.info('Queued fault for FuzzManager, {} pending.'.format(self.queue.pending()))
 
+    @staticmethod
+    def submit(entry, meta):
         command = [
-            "python", self.collector_script,
+            "python", meta['collector_script'],
             "--tool", "framboise",
             "--submit",
-            "--binary", self.binary]
+            "--binary", meta['binary']]
 
-        if crashdata:
-            command += ["--crashdata", crashdata]
-        if testcase:
-            command += ["--testcase", testcase]
+        if 'crashdata' in meta:
+            command += ["--crashdata", os.path.join(entry, meta['crashdata'])]
+        if 'testcase' in meta:
+            command += ["--testcase", os.path.join(entry, meta['testcase'])]
 
         print("Sending to FuzzManager: {}".format(command))
 
-        try:
-            subprocess.call(command)
-        except Exception as e:
-            logging.exception(e)
-        else:
-            logdir.cleanup()
+        return subprocess.call(command, **subprocess_timeout(300)) == 0
+
+    @staticmethod
+    def release(entry, meta):
+        """
+        Uncount the submission of an entry which could not be uploaded, so that
+        the next hit of its signature is submitted again.
+        """
+        if meta.get('signature') and meta.get('signature_db'):
+            SignatureIndex(meta['signature_db']).release(meta['signature'])
 
 
 class FilesystemLogger(Logger):
     """
     Bucket class to save crash information to disk.
+
+    With 'compression' set to gzip or zstd, fault folders only hold a manifest
+    and the artifacts go to a deduplicating ArtifactStore in '<path>/blobs'.
+    export_faults() recreates the plain layout from such a bucket.
+
+    Targets killed for exceeding their memory limit are kept in 'oom' next to
+    'faults', so that they are not triaged or replayed as crashes.
     """
 
     BUCKET_ID = 'framboise_{}'.format(time.strftime('%a_%b_%d_%H-%M-%S_%Y'))
+    INDEX = 'index.jsonl'
 
     def __init__(self, **kwargs):
+        self.compression = None
+        self.compression_level = None
         super(FilesystemLogger, self).__init__()
         self.__dict__.update(kwargs)
+        self.store = None
+        if self.compression:
+            self.store = ArtifactStore(os.path.join(self.build_path(self.path), 'blobs'),
+                                       self.compression, self.compression_level)
         self.bucketpath = os.path.join(self.build_path(self.path), self.BUCKET_ID)
         self.faultspath = os.path.join(self.bucketpath, 'faults')
-        if not self.bucketpath:
+        self.oompath = os.path.join(self.bucketpath, 'oom')
+        self.next_ids = {}
+        if not os.path.isdir(self.faultspath):
             try:
-                os.makedirs(self.bucketpath)
+                os.makedirs(self.faultspath)
+            except OSError:
+                pass  # created by another worker
+
+    def allocate_fault(self, faultspath=None):
+        """
+        Reserve the next free fault folder and return (fault_id, path).
+
+        Workers share the bucket, so a number is only taken once its folder was
+        created by us. Probing starts after the last indexed fault and continues
+        from the last number we got, making each allocation O(1) in the number
+        of existing faults.
+        """
+        faultspath = faultspath or self.faultspath
+        if faultspath not in self.next_ids:
+            if not os.path.isdir(faultspath):
+                try:
+                    os.makedirs(faultspath)
+                except OSError:
+                    pass  # created by another worker
+            self.next_ids[faultspath] = self.last_indexed(faultspath) + 1
+        while True:
+            fault_id = self.next_ids[faultspath]
+            self.next_ids[faultspath] += 1
+            faultpath = os.path.join(faultspath, str(fault_id))
+            try:
+                os.mkdir(faultpath)
             except OSError as e:
-                logging.exception(e)
+                if os.path.isdir(faultpath):
+                    continue  # taken by another worker
+                raise e
+            return fault_id, faultpath
+
+    def last_indexed(self, faultspath=None):
+        """
+        Return the highest fault ID in the tail of the index, or -1.
+        """
+        try:
+            with open(os.path.join(faultspath or self.faultspath, self.INDEX), 'rb') as fo:
+                fo.seek(0, os.SEEK_END)
+                fo.seek(max(0, fo.tell() - 4096))
+                lines = fo.read().splitlines()
+        except (IOError, OSError):
+            return -1
+        last = -1
+        for line in lines:
+            try:
+                last = max(last, json.loads(line.decode('utf-8'))['id'])
+            except (ValueError, KeyError, TypeError):
+                continue  # partial first line of the tail
+        return last
 
     def add_fault(self):
-        faultpath = os.path.join(self.faultspath, str(self.faults))
+        faultspath = self.oompath if 'oom' in self.bucket else self.faultspath
         try:
-            os.makedirs(faultpath)
+            fault_id, faultpath = self.allocate_fault(faultspath)
         except OSError as e:
             logging.exception(e)
             return
+        files = {}
         for name, meta in self.bucket.items():
             if 'data' not in meta or not meta['data']:
                 logging.error('Bucket "{}" does not contain "data" field or field is empty.'.format(name))
@@ -557,34 +1292,148 @@ class FilesystemLogger(Logger):
             if 'name' not in meta or not meta['name']:
                 logging.error('Bucket "{}" does not contain "name" field or field is empty.'.format(name))
                 continue
-            filename = os.path.join(faultpath, meta['name'])
             try:
-                with open(filename, 'wb') as fo:
-                    fo.write(meta['data'].encode('UTF-8'))
+                if self.store is not None:
+                    files[meta['name']] = self.store.put(self.iter_chunks(meta['data']))
+                else:
+                    self.write_data(os.path.join(faultpath, meta['name']), meta['data'])
+                    files[meta['name']] = None
+            except (IOError, OSError) as e:
+                logging.exception(e)
+        if self.store is not None:
+            try:
+                self.store.write_manifest(faultpath, files)
             except IOError as e:
                 logging.exception(e)
+        entry = {'id': fault_id, 'time': time.time(), 'pid': os.getpid(), 'files': sorted(files)}
+        try:
+            # Appends of a single short line are atomic, no locking needed.
+            with open(os.path.join(faultspath, self.INDEX), 'a') as fo:
+                fo.write(json.dumps(entry, sort_keys=True) + '\n')
+        except IOError as e:
+            logging.exception(e)
+
+    def index(self, faultspath=None):
+        """
+        Yield the index entries of all faults in the bucket, or of the OOM
+        kills with `faultspath` set to `oompath`.
+        """
+        indexpath = os.path.join(faultspath or self.faultspath, self.INDEX)
+        if not os.path.exists(indexpath):
+            return
+        with open(indexpath) as fo:
+            for line in fo:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
 
     @property
     def faults(self):
+        return sum(1 for _ in self.index())
+
+    @staticmethod
+    def export_faults(bucketpath, dest):
+        """
+        Copy the faults of a bucket to `dest` in the plain layout, decompressing
+        stored artifacts.
+        """
+        store = FilesystemLogger.bucket_store(bucketpath)
         count = 0
-        if not os.path.exists(self.faultspath):
-            return count
-        for item in os.listdir(self.faultspath):
-            item = os.path.join(self.faultspath, item)
-            if os.path.isdir(item) and not item.startswith('.'):
+        for kind in ('faults', 'oom'):
+            faultspath = os.path.join(bucketpath, kind)
+            if not os.path.isdir(faultspath):
+                continue
+            for fault in sorted(os.listdir(faultspath)):
+                folder = os.path.join(faultspath, fault)
+                if not os.path.isdir(folder):
+                    continue
+                target = os.path.join(dest, kind, fault)
+                if ArtifactStore.read_manifest(folder) is not None:
+                    store.export(folder, target)
+                else:
+                    shutil.copytree(folder, target)
                 count += 1
+        logging.info('Exported {} faults to {}.'.format(count, dest))
         return count
 
+    @staticmethod
+    def bucket_store(bucketpath):
+        """
+        Return the ArtifactStore shared by the buckets next to `bucketpath`.
+        """
+        return ArtifactStore(os.path.join(os.path.dirname(os.path.abspath(bucketpath)), 'blobs'))
+
+    @staticmethod
+    def read_artifact(folder, name):
+        """
+        Return file `name` of a fault folder as text, from the ArtifactStore if
+        the folder only holds a manifest; None if the fault has no such file.
+        """
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            with io.open(path, encoding='utf-8', errors='replace') as fo:
+                return fo.read()
+        entry = (ArtifactStore.read_manifest(folder) or {}).get(name)
+        if entry is None:
+            return None
+        # <path>/<bucket>/faults/<id>
+        store = FilesystemLogger.bucket_store(os.path.dirname(os.path.dirname(os.path.abspath(folder))))
+        return b''.join(store.iter_chunks(entry)).decode('utf-8', 'replace')
+
+
+class Session(object):
+    """
+    Bookkeeping for session mode, where one browser process runs many testcases.
+
+    The process is recycled after `max_testcases` testcases, once its resident
+    memory exceeds `max_rss` bytes or when a fault was detected.
+    """
+
+    REPORT_INTERVAL = 100
+
+    def __init__(self, max_testcases, max_rss=None):
+        self.max_testcases = max_testcases
+        self.max_rss = max_rss
+        self.testcases = 0
+        self.started = time.time()
+        self.recycle = threading.Event()
+        self.reason = None
+
+    @property
+    def rate(self):
+        return self.testcases / max(time.time() - self.started, 1e-6)
+
+    def finished_testcase(self):
+        """
+        Count a finished testcase and return whether another one may run.
+        """
+        self.testcases += 1
+        if self.testcases % self.REPORT_INTERVAL == 0:
+            logging.info('Session: {} testcases, {:.2f} testcases/s.'.format(self.testcases, self.rate))
+        if self.testcases >= self.max_testcases:
+            self.request_recycle('testcase limit')
+        return not self.recycle.is_set()
+
+    def request_recycle(self, reason):
+        if not self.recycle.is_set():
+            self.reason = reason
+            self.recycle.set()
+
 
 class PluginRunner(object):
 
-    def __init__(self, plugin, plugin_configuration, target):
+    def __init__(self, plugin, plugin_configuration, target, limits=None, display=None):
         self.plugin = plugin()
         self.plugin.configuration = plugin_configuration
         self.plugin.target = target
+        self.plugin.limits = limits
+        self.plugin.display = display
 
     def start(self):
+        start = time.time()
         self.plugin.start()
+        stats.observe('target_start_seconds', time.time() - start, plugin=self.plugin.name())
 
     def stop(self):
         self.plugin.stop()
@@ -592,12 +1441,34 @@ class PluginRunner(object):
 
 class Framboise(object):
 
+    # Seconds a crashed target gets to finish its report and exit in session mode.
+    CRASH_GRACE_PERIOD = 30
+    # ASan reports of allocations failing because of the memory limit.
+    OOM_PATTERNS = (
+        'AddressSanitizer: out of memory',
+        'AddressSanitizer: allocation-size-too-big',
+        'rss limit exhausted',
+    )
+
     def __init__(self):
         self.verbose = False
         self.config = None
         self.runner = None
         self.monitors = []
         self.loggers = []
+        self.fault_counter = None
+        self.session_testcases = 0
+        self.session_max_rss = None
+        self.session = None
+        self.hang_timeout = 0
+        self.watchdog = None
+        self.generator = None
+        self.assets = None
+        self.scheduler = None
+        self.comparator = None
+        self.target_index = 0
+        self.limits = None
+        self.display = None
 
     def load(self, config_path):
         with open(config_path) as fo:
@@ -616,12 +1487,57 @@ class Framboise(object):
             m.append(n)
         return m
 
+    @staticmethod
+    def build_bundle(fuzzers):
+        """
+        Concatenate the modules of a '-fuzzer' list into bundles/<hash>.js, so
+        that the page loads them with a single request; returns the relative
+        URL of the bundle or None if a module is missing.
+        """
+        names = sorted(set(pair.split(':')[-1] for pair in fuzzers.split(',')))
+        parts = []
+        for name in names:
+            path = os.path.join(ROOT, 'modules', name, 'fuzzer.js')
+            if not os.path.isfile(path):
+                logging.warning('Module "{}" not found, loading modules separately.'.format(name))
+                return None
+            with open(path, 'rb') as fo:
+                parts.append(b'/* modules/' + name.encode('utf-8') + b'/fuzzer.js */\n' + fo.read() + b'\n;\n')
+        data = b''.join(parts)
+        folder = os.path.join(ROOT, 'bundles')
+        filename = os.path.join(folder, hashlib.sha1(data).hexdigest()[:16] + '.js')
+        if not os.path.exists(filename):
+            if not os.path.isdir(folder):
+                try:
+                    os.makedirs(folder)
+                except OSError:
+                    pass  # created by another worker
+            tmp = '{}.{}.tmp'.format(filename, os.getpid())
+            with open(tmp, 'wb') as fo:
+                fo.write(data)
+            os.rename(tmp, filename)
+            logging.info('Bundled {} into {}.'.format(', '.join(names), os.path.relpath(filename, ROOT)))
+        return 'bundles/' + os.path.basename(filename)
+
     def set_fuzzer(self, args):
         config = self.config['targets'][args.target]['setups'][args.setup]
         if args.ws_port is not None:
             config['websocket_port'] = args.ws_port
         elif 'websocket_port' not in config:
             config['websocket_port'] = 0
+        if args.fuzzer and args.pregenerate and self.generator is None:
+            self.generator = CommandGenerator(ROOT, {
+                'fuzzers': args.fuzzer,
+                'maxCommands': args.max_commands,
+                'timeout': args.timeout,
+                'commands': {
+                    'settimeout': args.with_set_timeout,
+                    'setinterval': args.with_set_interval,
+                    'events': args.with_events,
+                },
+            }, processes=args.pregenerate, seed=args.random_seed)
+        if args.fuzzer and args.adaptive:
+            self.scheduler = ModuleScheduler(args.fuzzer)
         if args.fuzzer:
             params = urlencode({
                 'fuzzer': args.fuzzer,
@@ -633,9 +1549,16 @@ class Framboise(object):
                 'with-set-interval': args.with_set_interval,
                 'with-events': args.with_events,
                 'ws-logger': config['websocket_port'],
+                'session': bool(args.session),
+                'heartbeat': args.hang_timeout * 1000 // 4,
+                'pregenerated': self.generator is not None,
+                'bundle': self.build_bundle(args.fuzzer) or '',
+                'feedback': self.scheduler is not None or self.comparator is not None,
             })
             pathname = os.path.join(ROOT, urljoin('index.html', '?' + params))
-            if sys.platform == "win32":
+            if self.assets is not None:
+                fuzzer = urljoin(self.assets.url, 'index.html?' + params)
+            elif sys.platform == "win32":
                 fuzzer = unquote('file:' + pathname2url(pathname))
             else:
                 fuzzer = unquote('file://' + pathname)
@@ -646,21 +1569,113 @@ class Framboise(object):
         return fuzzer
 
     def start(self, target, setup, fuzzer):
+        """
+        Run the target once; returns True if a session was recycled for a
+        reason other than a crash or a hang.
+        """
         plugin = self.get_plugin_class(target)
         plugin_config = self.config['targets'][target]['setups'][setup]
 
-        self.runner = PluginRunner(plugin, plugin_config, target=fuzzer)
+        self.session = None
+        if self.session_testcases:
+            self.session = Session(self.session_testcases, self.session_max_rss)
+
+        if self.limits is None and plugin_config.get('limits'):
+            self.limits = ResourceLimits.from_config(plugin_config['limits'],
+                                                     'worker-{}-{}'.format(os.getpid(), self.target_index))
+
+        self.runner = PluginRunner(plugin, plugin_config, target=fuzzer, limits=self.limits, display=self.display)
         self.runner.start()
 
         self._handle_monitors(plugin_config)
         self._handle_loggers(plugin_config)
 
-        self.runner.plugin.wait(self.config['default']['process_timeout'])
+        if self.session is None and self.watchdog is None:
+            self.runner.plugin.wait(self.config['default']['process_timeout'])
+        else:
+            reason = self._wait_target(self.config['default']['process_timeout'])
+            if reason is not None:
+                return self._recycle(reason)
 
         logging.info('Exit code: {}'.format(self.runner.plugin.process.returncode))
 
         if self.runner.plugin.process.returncode != 0:
+            self._drain_monitors()
             self._check_for_faults()
+        return False
+
+    def _wait_target(self, timeout=None):
+        """
+        Wait for the target to exit; returns why it has to be recycled instead.
+        """
+        plugin = self.runner.plugin
+        session = self.session
+        end_time = time.time() + timeout if timeout else None
+        recycle = session.recycle if session is not None else threading.Event()
+        while plugin.process.poll() is None:
+            if recycle.wait(0.25):
+                return session.reason
+            plugin.track()
+            reason = None
+            if self.watchdog is not None and self.watchdog.gap() > self.hang_timeout:
+                reason = 'hang'
+            elif session is not None and session.max_rss and (plugin.memory_usage() or 0) > session.max_rss:
+                reason = 'memory limit'
+            elif session is not None and self._detected_crash():
+                reason = 'fault'
+            elif end_time is not None and time.time() >= end_time:
+                if session is None:
+                    plugin.stop()
+                    break
+                reason = 'process timeout'
+            if reason is not None:
+                if session is not None:
+                    session.request_recycle(reason)
+                return reason
+        plugin.process.wait()
+        return None
+
+    def _recycle(self, reason):
+        """
+        Stop a target which is still running; returns True to start a new one.
+        Crashes and hangs only relaunch the target with -restart, as when it
+        runs without a session.
+        """
+        plugin = self.runner.plugin
+        stats.inc('recycles_total', reason=reason)
+        if self.session is not None:
+            logging.info('Recycling session after {} testcases ({:.2f} testcases/s): {}.'.format(
+                self.session.testcases, self.session.rate, reason))
+        if reason == 'hang':
+            gap = self.watchdog.gap()
+            logging.warning('Target hung, no heartbeat for {:.1f}s.'.format(gap))
+            report = ['No heartbeat for {:.1f}s.'.format(gap), '', plugin.stack_sample() or 'No stack sample available.']
+            self._check_for_faults({'hang': {'data': os.linesep.join(report), 'name': 'hang.txt'}})
+        elif reason == 'fault':
+            # No 'NEXT' is sent anymore; let ASan finish its report and exit.
+            end_time = time.time() + self.CRASH_GRACE_PERIOD
+            while plugin.process.poll() is None and time.time() < end_time:
+                time.sleep(0.1)
+            if plugin.process.poll() is None:
+                logging.warning('Target did not exit {}s after the crash.'.format(self.CRASH_GRACE_PERIOD))
+            self._drain_monitors()
+            self._check_for_faults()
+        plugin.stop()
+        return self.session is not None and reason not in ('fault', 'hang')
+
+    def _drain_monitors(self):
+        """
+        Wait until the console output of an exited target was dispatched.
+        """
+        if self.runner.plugin.process.poll() is None:
+            return
+        for monitor in self.monitors:
+            if isinstance(monitor, ConsoleMonitor):
+                monitor.drain()
+
+    def _detected_crash(self):
+        return any(l.detected_fault() for m in self.monitors for l in m.listeners
+                   if isinstance(l, (AsanListener, SyzyListener)))
 
     @staticmethod
     def get_plugin_class(name):
@@ -670,14 +1685,67 @@ class Framboise(object):
             classname = 'DefaultPlugin'
         return globals()[classname]
 
-    def _check_for_faults(self):
+    def _crash_signature(self):
+        for monitor in self.monitors:
+            for listener in monitor.listeners:
+                if isinstance(listener, AsanListener) and listener.detected_fault():
+                    return listener.signature()[0]
+        return None
+
+    def _out_of_memory(self):
+        """
+        Return a report if the target was killed for exceeding its memory
+        limit or ASan ran out of memory, otherwise None.
+        """
+        report = []
+        if self.limits is not None and self.limits.oom_killed():
+            peak = self.limits.peak_memory()
+            report.append('{} process(es) killed by the OOM killer, memory limit {} MB, peak {} MB.'.format(
+                self.limits.oom_killed(), self.limits.memory, peak // (1024 * 1024) if peak else 'unknown'))
+        for monitor in self.monitors:
+            for listener in monitor.listeners:
+                if isinstance(listener, AsanListener) and listener.detected_fault():
+                    for line in listener.crashlog.iter_lines():
+                        if any(pattern in line for pattern in self.OOM_PATTERNS):
+                            report.append(line.strip())
+                            break
+        return os.linesep.join(report) or None
+
+    def _check_for_faults(self, bucket=None):
+        if bucket is None:
+            report = self._out_of_memory()
+            if report is not None:
+                logging.warning('Target ran out of memory.')
+                bucket = {'oom': {'data': report, 'name': 'oom.txt'}}
+        kind = 'crash'
+        for name in ('hang', 'oom'):
+            if bucket and name in bucket:
+                kind = name
+        signature = None
+        if kind != 'oom' and (self.scheduler is not None or self.comparator is not None):
+            signature = self._crash_signature()
+        if self.scheduler is not None and self.scheduler.record_fault(signature):
+            logging.info('New crash signature, crediting modules: {}'.format(
+                ', '.join(self.scheduler.last_modules)))
+        if self.comparator is not None and getattr(self.generator, 'current', None):
+            self.comparator.record_crash(self.target_index, self.generator.current['seed'],
+                                         signature if kind != 'oom' else 'oom')
+        if bucket:
+            for logger in self.loggers:
+                logger.add_to_bucket(bucket)
         for monitor in self.monitors:
             if monitor.detected_fault():
                 monitor_data = monitor.get_data()
                 for logger in self.loggers:
                     logger.add_to_bucket(monitor_data)
         for logger in self.loggers:
+            start = time.time()
             logger.add_fault()
+            stats.inc('faults_total', logger=type(logger).__name__, kind=kind)
+            stats.observe('fault_seconds', time.time() - start, logger=type(logger).__name__)
+        if self.fault_counter is not None:
+            with self.fault_counter.get_lock():
+                self.fault_counter.value += 1
 
     def _handle_loggers(self, config):
         self.loggers = []
@@ -695,6 +1763,7 @@ class Framboise(object):
 
     def _handle_monitors(self, config):
         self.monitors = []
+        self.watchdog = None
         if 'monitors' not in config:
             config['monitors'] = ['console', 'testcase', 'asan']
         if isinstance(config['monitors'][0], str):
@@ -713,10 +1782,30 @@ class Framboise(object):
                 listener_name = l.title() + 'Listener'
                 if listener_name not in globals():
                     raise Exception('Unknown listener type: {}'.format(l))
-                monitor.add_listener(globals()[listener_name]())
+                listener_config = config.get('listeners', {}).get(l) or {}
+                monitor.add_listener(globals()[listener_name](**listener_config))
+            if root == 'websocket' and self.session is not None:
+                monitor.add_listener(SessionListener(self.session))
+            if root == 'websocket' and self.generator is not None:
+                monitor.add_listener(BatchListener(self.generator))
+            if root == 'websocket' and self.scheduler is not None:
+                monitor.add_listener(AdaptiveListener(self.scheduler, self.generator))
+            if root == 'websocket' and self.comparator is not None:
+                monitor.add_listener(DifferentialListener(self.comparator, self.target_index))
+            if root == 'websocket' and self.hang_timeout:
+                self.watchdog = WatchdogListener()
+                monitor.add_listener(self.watchdog)
             monitor.daemon = True
             monitor.start()
             self.monitors.append(monitor)
+        if self.session is not None and not any(isinstance(m, WebSocketMonitor) for m in self.monitors):
+            raise FramboiseException('Session mode requires a websocket monitor.')
+        if self.generator is not None and not any(isinstance(m, WebSocketMonitor) for m in self.monitors):
+            raise FramboiseException('Pregenerated mode requires a websocket monitor.')
+        if self.scheduler is not None and not any(isinstance(m, WebSocketMonitor) for m in self.monitors):
+            raise FramboiseException('Adaptive weights require a websocket monitor.')
+        if self.hang_timeout and self.watchdog is None:
+            raise FramboiseException('Hang detection requires a websocket monitor.')
 
     def stop(self):
         for monitor in self.monitors:
@@ -725,13 +1814,462 @@ class Framboise(object):
             self.runner.stop()
 
 
-def main(args):
+class Worker(object):
+    """
+    Bookkeeping for a single supervised worker process.
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.process = None
+        self.launches = 0
+        self.faults = multiprocessing.Value('i', 0)
+        self.started = None
+        self.uptime = 0.0
+        self.backoff = 0
+        self.next_start = None
+
+    @property
+    def total_uptime(self):
+        if self.started is not None:
+            return self.uptime + time.time() - self.started
+        return self.uptime
+
+
+class Supervisor(object):
+    """
+    Launches -worker N processes with a stagger, restarts dead workers with an
+    exponential backoff when -restart is set and stops them on SIGINT/SIGTERM.
+    """
+
+    # A worker which stayed up for this long has its backoff reset.
+    HEALTHY_UPTIME = 60
+    MAX_BACKOFF = 300
+    # Grace period for workers to clean up after SIGTERM before they are killed.
+    STOP_TIMEOUT = 10
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = [Worker(i) for i in range(args.worker)]
+        self.stagger = args.worker_stagger
+        self.backoff = args.worker_backoff
+        self.stopping = False
+        self.stats = None
+        if args.stats_dir:
+            if not os.path.isdir(args.stats_dir):
+                os.makedirs(args.stats_dir)
+            self.stats = StatsAggregator(args.stats_dir, args.stats_interval, args.stats_port, self.metrics)
+        self.displays = None
+        if args.xvfb:
+            self.displays = DisplayPool(args.worker, max(1, args.xvfb_workers), args.xvfb_screen)
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+
+        if self.displays is not None:
+            try:
+                self.displays.start()
+            except OSError as e:
+                logging.error('Unable to start Xvfb: {}'.format(e))
+                self.displays.stop()
+                return
+        if self.stats is not None:
+            self.stats.start()
+
+        now = time.time()
+        for worker in self.workers:
+            worker.next_start = now + worker.number * self.stagger
+
+        while not self.stopping:
+            now = time.time()
+            if self.displays is not None:
+                self._check_displays()
+            for worker in self.workers:
+                if worker.process is not None and not worker.process.is_alive():
+                    self._reap(worker, now)
+                if worker.process is None and worker.next_start is not None and now >= worker.next_start:
+                    self._launch(worker)
+
+            pending = [w.next_start for w in self.workers if w.process is None and w.next_start is not None]
+            running = [w.process for w in self.workers if w.process is not None]
+            if not pending and not running:
+                break
+            timeout = 1.0
+            if pending:
+                timeout = max(0, min(min(pending) - time.time(), timeout))
+            if wait_for_processes is not None:
+                wait_for_processes([p.sentinel for p in running], timeout)
+            else:
+                time.sleep(timeout)
+
+        self.shutdown()
+        if self.displays is not None:
+            self.displays.stop()
+        self.report()
+        if self.stats is not None:
+            self.stats.stop()
+
+    def _on_signal(self, signum, frame):
+        logging.info('Caught signal {}, stopping workers.'.format(signum))
+        self.stopping = True
+
+    def _check_displays(self):
+        for index in self.displays.check():
+            # The workers still point to the old display number.
+            for worker in self.workers:
+                if worker.number in self.displays.workers(index) and worker.process is not None:
+                    logging.warning('Restarting worker {} on display {}.'.format(
+                        worker.number, self.displays.displays[index].name))
+                    worker.process.terminate()
+                    worker.next_start = time.time()
+
+    def _launch(self, worker):
+        display = self.displays.display(worker.number) if self.displays is not None else None
+        worker.process = multiprocessing.Process(target=worker_main,
+                                                 args=(self.args, worker.faults, worker.number, display))
+        worker.process.start()
+        worker.launches += 1
+        worker.started = time.time()
+        worker.next_start = None
+        logging.info('Worker {} started (pid {}, launch #{}).'.format(
+            worker.number, worker.process.pid, worker.launches))
+
+    def _reap(self, worker, now):
+        exitcode = worker.process.exitcode
+        alive = now - worker.started
+        worker.uptime += alive
+        worker.started = None
+        worker.process = None
+        if exitcode == 0 or not self.args.restart or self.stopping:
+            logging.info('Worker {} exited with code {}.'.format(worker.number, exitcode))
+            return
+        if alive >= self.HEALTHY_UPTIME:
+            worker.backoff = 0
+        worker.backoff = min(max(worker.backoff * 2, self.backoff), self.MAX_BACKOFF)
+        worker.next_start = now + worker.backoff
+        logging.warning('Worker {} died with code {}, restarting in {:.1f}s.'.format(
+            worker.number, exitcode, worker.backoff))
+
+    def shutdown(self):
+        running = [w.process for w in self.workers if w.process is not None and w.process.is_alive()]
+        for process in running:
+            process.terminate()
+        end_time = time.time() + self.STOP_TIMEOUT
+        for process in running:
+            process.join(max(0, end_time - time.time()))
+            if process.is_alive():
+                logging.warning('Worker pid {} did not stop, killing it.'.format(process.pid))
+                os.kill(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                process.join()
+        for worker in self.workers:
+            if worker.process is not None:
+                self._reap(worker, time.time())
+
+    def metrics(self):
+        """
+        Per-worker counters of the supervisor as (name, labels, value).
+        """
+        metrics = []
+        for worker in self.workers:
+            labels = {'worker': str(worker.number)}
+            metrics.append(('worker_launches', labels, worker.launches))
+            metrics.append(('worker_faults', labels, worker.faults.value))
+            metrics.append(('worker_uptime_seconds', labels, round(worker.total_uptime, 1)))
+            metrics.append(('worker_running', labels, int(worker.process is not None)))
+        if self.displays is not None:
+            metrics.append(('xvfb_restarts', {}, self.displays.restarts))
+        return metrics
+
+    def report(self):
+        for worker in self.workers:
+            logging.info('Worker {}: {} launches, {} faults, {:.0f}s uptime.'.format(
+                worker.number, worker.launches, worker.faults.value, worker.total_uptime))
+
+
+def worker_main(args, faults=None, number=0, display=None):
+    # Forked workers inherit the supervisor's handlers; restore Ctrl-C and
+    # unwind main() on SIGTERM so that the target is stopped and cleaned up.
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    stats_path = None
+    if args.stats_dir:
+        stats_path = os.path.join(args.stats_dir, 'worker-{}.json'.format(number))
+        stats.start_flushing(stats_path, args.stats_interval)
+    if args.http_port:
+        # Workers serve their fuzzer page on consecutive ports.
+        args.http_port += number
+    try:
+        main(args, faults, display)
+    finally:
+        # Let a submission in progress finish rather than kill it midway.
+        SubmissionQueue.stop_all(timeout=30)
+        if stats_path:
+            stats.flush(stats_path)
+
+
+def replay_file(args, path):
+    """
+    Open the testcase at `path` in the target; returns the signature of the
+    ASan crash it caused or None.
+    """
+    framboise = Framboise()
+    framboise.load(args.settings)
+    config = framboise.config['targets'][args.target]['setups'][args.setup]
+    runner = PluginRunner(framboise.get_plugin_class(args.target), config, target=path)
+    runner.start()
+    listener = AsanListener()
+    monitor = ConsoleMonitor(process=runner.plugin.process)
+    monitor.add_listener(listener)
+    monitor.daemon = True
+    monitor.start()
+    try:
+        runner.plugin.wait(args.replay_timeout)
+    finally:
+        runner.stop()
+        monitor.drain()
+    if not listener.detected_fault():
+        return None
+    return listener.signature()[0]
+
+
+def replay_folder():
+    """
+    Folder below ROOT for generated testcase pages, so that they can load the
+    runtime like the fuzzer page does.
+    """
+    folder = os.path.join(ROOT, 'replay')
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass  # created by another process
+    return folder
+
+
+def runtime_root(path):
+    """
+    Relative URL from the folder of `path` to ROOT, for write_html().
+    """
+    relative = os.path.relpath(ROOT, os.path.dirname(os.path.abspath(path)))
+    return relative.replace(os.sep, '/') + '/'
+
+
+def replay_display(args):
+    """
+    Start one Xvfb server for -reduce and -replay with -xvfb. Its DISPLAY is
+    set in the environment, so that every replaying process inherits it as
+    under xvfb-run. Returns the DisplayPool or None.
+    """
+    if not args.xvfb:
+        return None
+    displays = DisplayPool(1, screen=args.xvfb_screen)
+    displays.start()
+    os.environ['DISPLAY'] = displays.display(0)
+    return displays
+
+
+def replay_commands(args, commands):
+    """
+    Run the commands as a standalone testcase, see replay_file().
+    """
+    folder = tempfile.mkdtemp(prefix='reduce_', dir=replay_folder())
+    try:
+        path = os.path.join(folder, 'testcase.html')
+        write_html(path, commands, root=runtime_root(path))
+        return replay_file(args, path)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def reproduces(args, signature, commands):
+    try:
+        return replay_commands(args, commands) == signature
+    except Exception as e:
+        logging.exception(e)
+        return False
+
+
+def reduce_testcase(args):
+    """
+    Minimize a testcase.txt to the commands needed for its ASan crash.
+    """
+    text = FilesystemLogger.read_artifact(os.path.dirname(os.path.abspath(args.reduce)),
+                                          os.path.basename(args.reduce))
+    if text is None:
+        logging.error('Unable to read {}.'.format(args.reduce))
+        return 1
+    commands = parse_commands(text)
+    logging.info('Replaying {} commands of {}.'.format(len(commands), args.reduce))
+    signature = replay_commands(args, commands)
+    if signature is None:
+        logging.error('Testcase does not reproduce, nothing to reduce.')
+        return 1
+    reducer = Reducer(functools.partial(reproduces, args, signature), processes=args.worker)
+    start = time.time()
+    reduced = reducer.reduce(commands)
+    base = os.path.splitext(args.reduce)[0]
+    write_commands(base + '.reduced.txt', reduced)
+    write_html(base + '.reduced.html', reduced, root=runtime_root(base))
+    logging.info('Reduced {} to {} commands with {} replays in {:.0f}s: {}.reduced.html'.format(
+        len(commands), len(reduced), reducer.tests, time.time() - start, base))
+    return 0
+
+
+def _replay_task(task):
+    args, name, path = task
+    try:
+        return name, replay_file(args, path), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+def replay_testcases(args):
+    """
+    Replay every testcase.txt below a folder -replay-runs times and write a
+    reproducibility report next to them.
+    """
+    html_folder = replay_folder()
+    cases = {}
+    for dirpath, _, filenames in os.walk(args.replay):
+        # Faults of compressed buckets only hold a manifest.
+        testcase = FilesystemLogger.read_artifact(dirpath, 'testcase.txt') \
+            if 'testcase.txt' in filenames or ArtifactStore.MANIFEST in filenames else None
+        if testcase is None:
+            continue
+        name = os.path.relpath(dirpath, args.replay)
+        # The hash keeps names apart which only differ in replaced characters.
+        html = os.path.join(html_folder, '{}-{}.html'.format(
+            re.sub(r'[^\w.-]', '_', name), hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]))
+        write_html(html, parse_commands(testcase), root=runtime_root(html))
+        expected = None
+        crashlog = FilesystemLogger.read_artifact(dirpath, 'crashlog.txt')
+        if crashlog is not None:
+            expected, _ = crash_signature(crashlog.splitlines())
+        cases[name] = {'html': html, 'signature': expected, 'runs': 0, 'crashes': 0,
+                       'reproduced': 0, 'signatures': {}, 'errors': []}
+    if not cases:
+        logging.error('No testcase.txt found in {}.'.format(args.replay))
+        return 1
+
+    logging.info('Replaying {} testcases {} times with {} processes.'.format(len(cases), args.replay_runs, args.worker))
+    start = time.time()
+    tasks = [(args, name, case['html']) for name, case in sorted(cases.items()) for _ in range(args.replay_runs)]
+    pool = multiprocessing.Pool(args.worker)
+    try:
+        for name, signature, error in pool.imap_unordered(_replay_task, tasks):
+            case = cases[name]
+            case['runs'] += 1
+            if error is not None:
+                case['errors'].append(error)
+            if signature is None:
+                continue
+            case['crashes'] += 1
+            case['signatures'][signature] = case['signatures'].get(signature, 0) + 1
+            if case['signature'] in (None, signature):
+                case['reproduced'] += 1
+    finally:
+        pool.terminate()
+        pool.join()
+
+    summary = {'reproduced': 0, 'flaky': 0, 'not reproduced': 0}
+    for name, case in sorted(cases.items()):
+        if case['reproduced'] == case['runs']:
+            case['status'] = 'reproduced'
+        elif case['reproduced']:
+            case['status'] = 'flaky'
+        else:
+            case['status'] = 'not reproduced'
+        summary[case['status']] += 1
+        logging.info('{}: {} ({}/{})'.format(name, case['status'], case['reproduced'], case['runs']))
+    report = os.path.join(args.replay, 'replay-report.json')
+    with open(report, 'w') as fo:
+        json.dump({'summary': summary, 'runs': args.replay_runs, 'timeout': args.replay_timeout,
+                   'seconds': round(time.time() - start, 1), 'testcases': cases}, fo, indent=1, sort_keys=True)
+    logging.info('{reproduced} reproduced, {flaky} flaky, {not reproduced} not reproduced.'.format(**summary))
+    logging.info('Report: {}'.format(report))
+    return 0
+
+
+def init_logging():
     logging.basicConfig(
         format='[Framboise] %(asctime)s %(levelname)s: %(message)s',
         level=logging.DEBUG)
 
+
+def run_target(framboise, args, fuzzer):
+    while True:
+        recycled = False
+        try:
+            recycled = framboise.start(args.target, args.setup, fuzzer)
+            if args.restart or recycled:
+                continue
+            break
+        except KeyboardInterrupt:
+            raise Exception('Caught SIGINT, aborting.')
+        except Exception as e:
+            logging.error(e)
+        finally:
+            logging.info('Stopping Framboise.')
+            framboise.stop()
+            if not args.restart and not recycled:
+                break
+
+
+def run_differential(framboise, args, fuzzer):
+    """
+    Run the batches of one generator against every target:setup pair of
+    -differential at once and log the testcases on which they disagree.
+    """
+    pairs = [pair.split(':') for pair in args.differential.split(',')]
+    names = ['{}:{}'.format(target, setup) for target, setup in pairs]
+    comparator = DifferentialComparator(names, args.differential_log)
+    fanout = BatchFanout(framboise.generator, len(pairs), on_batch=comparator.add_batch)
+    threads, instances = [], []
+    for index, (target, setup) in enumerate(pairs):
+        target_args = argparse.Namespace(**vars(args))
+        target_args.target, target_args.setup = target, setup
+        target_args.ws_port = args.ws_port + index
+        instance = Framboise()
+        instance.verbose = framboise.verbose
+        instance.fault_counter = framboise.fault_counter
+        instance.session_testcases = framboise.session_testcases
+        instance.session_max_rss = framboise.session_max_rss
+        instance.hang_timeout = framboise.hang_timeout
+        instance.display = framboise.display
+        instance.assets = framboise.assets
+        instance.config = copy.deepcopy(framboise.config)
+        instance.generator = fanout.view(index)
+        instance.comparator = comparator
+        instance.target_index = index
+        thread = threading.Thread(target=run_target, args=(instance, target_args, instance.set_fuzzer(target_args)),
+                                  name='Differential-{}'.format(names[index]))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+        instances.append(instance)
+    logging.info('Differential run of {}; divergences go to {}.'.format(', '.join(names), args.differential_log))
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+    finally:
+        for instance in instances:
+            instance.stop()
+    logging.info('Compared {} testcases, {} divergences.'.format(comparator.compared, comparator.divergences))
+
+
+def main(args, faults=None, display=None):
+    init_logging()
+
     framboise = Framboise()
     framboise.verbose = args.debug
+    framboise.fault_counter = faults
+    framboise.display = display
+    framboise.session_testcases = args.session
+    framboise.hang_timeout = args.hang_timeout
+    if args.session_max_rss:
+        framboise.session_max_rss = args.session_max_rss * 1024 * 1024
 
     if args.list_modules:
         print(framboise.modules)
@@ -755,23 +2293,39 @@ def main(args):
         logging.error('Setup "{}" is not defined in target "{}"'.format(args.setup, args.target))
         sys.exit(1)
 
+    if args.differential:
+        for pair in args.differential.split(','):
+            target, _, setup = pair.partition(':')
+            if setup not in framboise.config['targets'].get(target, {}).get('setups', {}):
+                logging.error('"{}" is not a target:setup pair of "{}".'.format(pair, args.settings))
+                sys.exit(1)
+        if not args.fuzzer or not args.pregenerate or args.ws_port is None:
+            logging.error('Differential runs require -fuzzer, -pregenerate and -websocket-port.')
+            sys.exit(1)
+
+    if args.http_port is not None and args.fuzzer:
+        framboise.assets = AssetServer(ROOT, args.http_port)
+        framboise.assets.start()
     fuzzer = framboise.set_fuzzer(args)
-
-    while True:
+    if framboise.generator is not None:
         try:
-            framboise.start(args.target, args.setup, fuzzer)
-            if args.restart:
-                continue
-            break
-        except KeyboardInterrupt:
-            raise Exception('Caught SIGINT, aborting.')
-        except Exception as e:
+            framboise.generator.start()
+        except GeneratorError as e:
             logging.error(e)
+            sys.exit(1)
+
+    if args.differential:
+        try:
+            run_differential(framboise, args, fuzzer)
         finally:
-            logging.info('Stopping Framboise.')
-            framboise.stop()
-            if not args.restart:
-                break
+            framboise.generator.stop()
+        return
+
+    run_target(framboise, args, fuzzer)
+    if framboise.generator is not None:
+        framboise.generator.stop()
+    if framboise.assets is not None:
+        framboise.assets.stop()
 
 
 if __name__ == '__main__':
@@ -791,6 +2345,10 @@ if __name__ == '__main__':
                         help='target environment')
     parser.add_argument('-worker', dest='worker', metavar='#', type=int, default=1,
                         help='number of worker instances')
+    parser.add_argument('-worker-stagger', dest='worker_stagger', metavar='#', type=float, default=1.0,
+                        help='seconds between worker launches')
+    parser.add_argument('-worker-backoff', dest='worker_backoff', metavar='#', type=float, default=1.0,
+                        help='initial delay before restarting a dead worker')
     parser.add_argument('-testcase', dest='testcase', metavar='file',
                         help='open target app with provided testcase')
     parser.add_argument('-launch', dest='launch', action='store_true', default=False,
@@ -801,6 +2359,49 @@ if __name__ == '__main__':
                         help='timeout for reload')
     parser.add_argument('-websocket-port', dest='ws_port', metavar='#', type=int,
                         help='WebSocket monitor port')
+    parser.add_argument('-session', dest='session', metavar='#', type=int, default=0,
+                        help='testcases per browser process in session mode (0: disabled)')
+    parser.add_argument('-session-max-rss', dest='session_max_rss', metavar='MB', type=int, default=0,
+                        help='recycle a session once the target uses more memory')
+    parser.add_argument('-hang-timeout', dest='hang_timeout', metavar='#', type=int, default=0,
+                        help='seconds without a heartbeat before the target counts as hung '
+                             '(0: disabled, requires a websocket monitor)')
+    parser.add_argument('-differential', dest='differential', metavar='list',
+                        help='run the same pregenerated testcases against several targets, '
+                             'syntax: target:setup [,...]; uses consecutive ports from -websocket-port')
+    parser.add_argument('-differential-log', dest='differential_log', metavar='file', default='differential.jsonl',
+                        help='where to log the testcases on which the targets disagree')
+    parser.add_argument('-adaptive', dest='adaptive', action='store_true', default=False,
+                        help='adapt the module weights to the new exceptions and crashes they find '
+                             '(requires a websocket monitor)')
+    parser.add_argument('-http-port', dest='http_port', metavar='#', type=int,
+                        help='serve the fuzzer page over HTTP on localhost instead of file:// (0: any free port); '
+                             'workers use consecutive ports')
+    parser.add_argument('-pregenerate', dest='pregenerate', metavar='#', type=int, default=0,
+                        help='generate testcases in this many Node.js processes instead of the browser '
+                             '(0: disabled, requires a websocket monitor)')
+    parser.add_argument('-xvfb', dest='xvfb', action='store_true', default=False,
+                        help='run the targets on a pool of Xvfb servers (-reduce, -replay: on one)')
+    parser.add_argument('-xvfb-workers', dest='xvfb_workers', metavar='#', type=int, default=1,
+                        help='workers per Xvfb server')
+    parser.add_argument('-xvfb-screen', dest='xvfb_screen', metavar='WxHxD', default='1024x768x24',
+                        help='screen of the Xvfb servers')
+    parser.add_argument('-stats-dir', dest='stats_dir', metavar='path',
+                        help='write per-worker and merged throughput stats to this folder')
+    parser.add_argument('-stats-interval', dest='stats_interval', metavar='#', type=int, default=10,
+                        help='seconds between stats updates')
+    parser.add_argument('-stats-port', dest='stats_port', metavar='#', type=int,
+                        help='serve Prometheus metrics on localhost (requires -stats-dir)')
+    parser.add_argument('-reduce', dest='reduce', metavar='file',
+                        help='minimize a testcase.txt which crashes the target (uses -worker processes)')
+    parser.add_argument('-replay', dest='replay', metavar='path',
+                        help='replay all testcase.txt files below a folder and report which reproduce')
+    parser.add_argument('-replay-runs', dest='replay_runs', metavar='#', type=int, default=3,
+                        help='replays per testcase for -replay')
+    parser.add_argument('-replay-timeout', dest='replay_timeout', metavar='#', type=int, default=10,
+                        help='seconds to wait for a crash when replaying a testcase (-reduce, -replay)')
+    parser.add_argument('-export-faults', dest='export_faults', metavar=('bucket', 'dest'), nargs=2,
+                        help='export the faults of a bucket uncompressed to a folder')
     parser.add_argument('-update', dest='update', metavar='name',
                         help='run update script for target')
     parser.add_argument('-list', dest='list_modules', action='store_true', default=False,
@@ -828,7 +2429,19 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    for _ in range(args.worker):
-        p = multiprocessing.Process(target=main, args=(args,))
-        p.start()
-        time.sleep(3)
+    init_logging()
+    if args.export_faults:
+        FilesystemLogger.export_faults(*args.export_faults)
+        sys.exit(0)
+    if args.reduce or args.replay:
+        try:
+            displays = replay_display(args)
+        except OSError as e:
+            logging.error('Unable to start Xvfb: {}'.format(e))
+            sys.exit(1)
+        try:
+            sys.exit(reduce_testcase(args) if args.reduce else replay_testcases(args))
+        finally:
+            if displays is not None:
+                displays.stop()
+    Supervisor(args).run()
@@ -0,0 +1,83 @@
+/*
+ * Headless command generator for Node.js.
+ *
+ * Loads octo.js, runtime.js and the fuzzer modules and answers one request per
+ * line on stdin with one batch per line on stdout:
+ *
+ *   {"seed": 1234, "weights": {"Canvas2D": 100}}
+ *   {"seed": 1234, "reloadTimeout": 512.3, "commands": ["...", ...], "modules": ["Canvas2D", ...]}
+ *
+ * Usage: node libs/js/generator.js '{"fuzzers": "1:Canvas2D", "maxCommands": 100}'
+ */
+const fs = require('fs')
+const path = require('path')
+const readline = require('readline')
+const vm = require('vm')
+
+const ROOT = path.join(__dirname, '..', '..')
+
+/* Just enough of a browser for the libraries to load. */
+global.window = global
+window.addEventListener = () => {}
+global.location = {search: '', protocol: 'file:', reload: () => {}}
+global.navigator = {userAgent: 'node'}
+global.document = {
+  addEventListener: () => {},
+  getElementById: () => null,
+  getElementsByTagName: () => ({item: () => null})
+}
+
+function load(file) {
+  vm.runInThisContext(fs.readFileSync(path.join(ROOT, file), 'utf-8'), {filename: file})
+}
+
+function loadFuzzers(list) {
+  return new Framboise().parseProbabilityList(list).map(([probability, name]) => {
+    load('modules/' + name + '/fuzzer.js')
+    if (!window['fuzzer' + name]) {
+      throw new Error('Unable to load fuzzer named: fuzzer' + name)
+    }
+    return [probability, window['fuzzer' + name], name]
+  })
+}
+
+function generate(config, fuzzers, seed, weights) {
+  /* Same order of random calls as Framboise.start() in the browser. */
+  let engine = new Engine(seed)
+  if (config.maxCommands) {
+    engine.prefs.maxCommands = random.range(Math.round((config.maxCommands / 2)) / 2, config.maxCommands)
+  }
+  if (config.timeout) {
+    engine.prefs.reloadTimeout = config.timeout
+  }
+  Object.assign(engine.prefs.commands, config.commands || {})
+  o = new Objects() /* global */
+  if (weights) {
+    fuzzers = fuzzers.map(([probability, fuzzer, name]) => [weights[name] || probability, fuzzer, name])
+  }
+  let commands = engine.generate(fuzzers)
+  return {seed: seed, reloadTimeout: engine.prefs.reloadTimeout, commands: commands, modules: engine.modules}
+}
+
+function main() {
+  let config = JSON.parse(process.argv[2] || '{}')
+  load('libs/js/octo.js')
+  load('libs/js/runtime.js')
+  let fuzzers = loadFuzzers(config.fuzzers)
+
+  /* Silence the logger, stdout belongs to the batches. */
+  logger.log = logger.info = logger.dumpln = logger.comment = logger.separator = () => {}
+
+  let input = readline.createInterface({input: process.stdin})
+  input.on('line', line => {
+    let request = JSON.parse(line), batch
+    try {
+      batch = generate(config, fuzzers, request.seed, request.weights)
+    } catch (e) {
+      batch = {seed: request.seed, error: '' + e}
+    }
+    process.stdout.write(JSON.stringify(batch) + '\n')
+  })
+}
+
+main()
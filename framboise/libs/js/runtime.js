@@ -5,6 +5,8 @@ class Framboise {
       value,
       randomSeed = null
 
+    this.bundle = this.parseParm('bundle', argv, String)
+
     try {
       fuzzers = this.parseParm('fuzzer', argv, this.parseFuzzers)
     } catch (e) {
@@ -36,10 +38,36 @@ class Framboise {
 
     value = this.parseParm('ws-logger', argv, parseInt)
     if (value) {
+      engine.prefs.session = this.parseParm('session', argv, this.parseBoolean)
+      let pregenerated = this.parseParm('pregenerated', argv, this.parseBoolean)
       websocket = new WebSocket('ws://localhost:' + value + '/')
+      websocket.onmessage = e => {
+        /* Session mode: the monitor decides when the next testcase starts. */
+        if (e.data === 'NEXT') {
+          window.location.reload()
+        } else if (e.data.startsWith('BATCH ')) {
+          engine.execute(JSON.parse(e.data.substring(6)))
+        } else if (e.data.startsWith('WEIGHTS ')) {
+          Feedback.storeWeights(e.data.substring(8))
+        }
+      }
+      if (this.parseParm('feedback', argv, this.parseBoolean)) {
+        engine.feedback = new Feedback()
+        engine.feedback.applyWeights(fuzzers)
+      }
+      let heartbeat = this.parseParm('heartbeat', argv, parseInt)
       websocket.onopen = e => {
+        if (heartbeat) {
+          /* Lets the monitor's watchdog tell a wedged page from a slow one. */
+          setInterval(() => websocket.send('/*H*/ HEARTBEAT'), heartbeat)
+        }
         engine.initialize()
-        engine.run(fuzzers)
+        if (pregenerated) {
+          /* Commands are generated by framboise.py, we only execute them. */
+          websocket.send('/*G*/ BATCH')
+        } else {
+          engine.run(fuzzers)
+        }
       }
     } else {
       engine.initialize()
@@ -88,13 +116,20 @@ class Framboise {
   parseFuzzers(param) {
     let fuzzers = this.parseProbabilityList(param), i
 
+    if (this.bundle) {
+      /* All selected modules in one request, built by framboise.py. */
+      this.loadFuzzer('framboiseBundle', this.bundle)
+    }
+
     for (i = 0; i < fuzzers.length; i++) {
       let name = 'fuzzer' + fuzzers[i][1]
 
-      try {
-        this.loadFuzzer(name, 'modules/' + fuzzers[i][1] + '/fuzzer.js')
-      } catch (e) {
-        throw new Error('Unable to load fuzzer named: ' + name)
+      if (!(window[name])) {
+        try {
+          this.loadFuzzer(name, 'modules/' + fuzzers[i][1] + '/fuzzer.js')
+        } catch (e) {
+          throw new Error('Unable to load fuzzer named: ' + name)
+        }
       }
 
       if (!(window[name])) {
@@ -103,7 +138,7 @@ class Framboise {
         i -= 1
       } else {
         logger.dumpln('[✓] Fuzzer: ' + name)
-        fuzzers[i][1] = window[name]
+        fuzzers[i] = [fuzzers[i][0], window[name], fuzzers[i][1]]
       }
     }
 
@@ -155,9 +190,14 @@ class Engine {
   constructor(seed) {
     random.init(seed)
 
+    this.sink = (cmd, prefs) => this.record(fuzz_content_sink(cmd, prefs))
+    this.feedback = null
+    this.module = null
+    this.names = new Map()
     this.prefs = {
       reloadTimeout: 0,
       maxCommands: 30,
+      session: false,
       commands: {
         settimeout: true,
         setinterval: true,
@@ -174,16 +214,24 @@ class Engine {
     logger.info('Seed: ' + random.seed)
   }
 
+  record(error) {
+    if (this.feedback) {
+      this.feedback.record(this.module, error)
+    }
+  }
+
   onInit(fuzzers) {
     let i, j, cmds, cmd
+    this.names = new Map(fuzzers.map(fuzzer => [fuzzer[1], fuzzer[2]]))
     for (i = 0; i < fuzzers.length; i++) {
+      this.module = fuzzers[i][2]
       cmds = fuzzers[i][1].onInit()
       cmds = typeof(cmds) === 'string' ? [cmds] : cmds;
       if (Array.isArray(cmds)) {
         for (j = 0; j < cmds.length; j++) {
           cmd = cmds[j]
           if (cmd.length > 0) {
-            fuzz_content_sink(cmd, this.prefs)
+            this.sink(cmd, this.prefs)
           }
         }
       }
@@ -214,6 +262,7 @@ class Engine {
 
     for (i = 0; i < this.prefs.maxCommands; i++) {
       fuzzer = random.choose(fuzzers)
+      this.module = this.names.get(fuzzer)
       cmds = fuzzer.makeCommand()
       cmds = typeof(cmds) === 'string' ? [cmds] : cmds
       if (Array.isArray(cmds)) {
@@ -225,15 +274,15 @@ class Engine {
           switch (random.number(16)) {
             case 0:
               if (this.prefs.commands.setinterval) {
-                n = Math.random() * 100
-                fuzz_content_sink('setInterval(' + Function(utils.script.safely(cmd)) + ', ' + n + ')', this.prefs)
+                n = random.float() * 100
+                this.sink('setInterval(' + Function(utils.script.safely(cmd)) + ', ' + n + ')', this.prefs)
               }
               break
             case 1:
               if (this.prefs.commands.settimeout) {
-                n = Math.random() * 1000
+                n = random.float() * 1000
                 this.prefs.reloadTimeout += n
-                fuzz_content_sink('setTimeout(' + Function(utils.script.safely(cmd)) + ', ' + n + ')', this.prefs)
+                this.sink('setTimeout(' + Function(utils.script.safely(cmd)) + ', ' + n + ')', this.prefs)
               }
               break
             case 2:
@@ -244,7 +293,7 @@ class Engine {
                   let evtCmds = this.makeSubCommands(fuzzers)
                   let callback = 'function(e) { ' + evtCmds + '}'
                   let params = [utils.common.quote(evtName), callback]
-                  fuzz_content_sink(o.pick(objName) + '.addEventListener' + utils.script.methodHead(params), this.prefs)
+                  this.sink(o.pick(objName) + '.addEventListener' + utils.script.methodHead(params), this.prefs)
                 }
               }
               if (this.prefs.commands.events && 'WindowEvents' in fuzzer) {
@@ -252,11 +301,11 @@ class Engine {
                 let evtCmds = this.makeSubCommands(fuzzers)
                 let callback = 'function(e) { ' + evtCmds + '}'
                 let params = [utils.common.quote(evtName), callback]
-                fuzz_content_sink('window.addEventListener' + utils.script.methodHead(params), this.prefs)
+                this.sink('window.addEventListener' + utils.script.methodHead(params), this.prefs)
               }
               break
             default:
-              fuzz_content_sink(cmd, this.prefs)
+              this.sink(cmd, this.prefs)
           }
         }
       }
@@ -267,12 +316,13 @@ class Engine {
     let i, j, cmds
 
     for (i = 0; i < fuzzers.length; i++) {
+      this.module = fuzzers[i][2]
       cmds = fuzzers[i][1].onFinish()
       cmds = typeof(cmds) === 'string' ? [cmds] : cmds
       if (Array.isArray(cmds)) {
         for (j = 0; j < cmds.length; j++) {
           if (cmds[j].length > 0) {
-            fuzz_content_sink(cmds[j], this.prefs)
+            this.sink(cmds[j], this.prefs)
           }
         }
       }
@@ -283,12 +333,111 @@ class Engine {
     this.onInit(fuzzers)
     this.makeCommands(fuzzers)
     this.onFinish(fuzzers)
-    fuzz_content_sink('setTimeout(\'window.location.reload()\', ' + this.prefs.reloadTimeout + ')', this.prefs)
+    if (this.feedback) {
+      this.feedback.send()
+    }
+    this.finish()
+  }
+
+  /*
+   * Collect the commands of a testcase instead of executing them.
+   */
+  generate(fuzzers) {
+    let commands = [], sink = this.sink
+    this.modules = []
+    this.sink = cmd => {
+      commands.push(cmd)
+      this.modules.push(this.module)
+    }
+    try {
+      this.onInit(fuzzers)
+      this.makeCommands(fuzzers)
+      this.onFinish(fuzzers)
+    } finally {
+      this.sink = sink
+    }
+    return commands
+  }
+
+  /*
+   * Run a batch which was generated by libs/js/generator.js.
+   */
+  execute(batch) {
+    logger.info('Batch seed: ' + batch.seed)
+    this.prefs.reloadTimeout = batch.reloadTimeout
+    batch.commands.forEach((cmd, i) => {
+      this.module = batch.modules ? batch.modules[i] : null
+      this.sink(cmd, this.prefs)
+    })
+    if (this.feedback) {
+      this.feedback.send(batch.seed)
+    }
+    this.finish()
+  }
+
+  finish() {
+    if (this.prefs.session) {
+      setTimeout(() => websocket.send('/*S*/ END TESTCASE'), this.prefs.reloadTimeout)
+    } else {
+      this.sink('setTimeout(\'window.location.reload()\', ' + this.prefs.reloadTimeout + ')', this.prefs)
+    }
     logger.comment('### END OF TESTCASE')
   }
 }
 
 
+/*
+ * Per-module command and exception counts of a testcase, reported to the
+ * module scheduler of framboise.py which answers with new weights, and for
+ * pregenerated batches to the comparison of differential runs.
+ */
+class Feedback {
+  constructor() {
+    this.commands = {}
+    this.errors = {}
+  }
+
+  record(module, error) {
+    if (!module) {
+      return
+    }
+    this.commands[module] = (this.commands[module] || 0) + 1
+    if (error) {
+      let errors = this.errors[module] = this.errors[module] || {}
+      let message = ('' + error).substring(0, 200)
+      errors[message] = (errors[message] || 0) + 1
+    }
+  }
+
+  send(seed) {
+    websocket.send('/*W*/ ' + JSON.stringify({seed: seed, commands: this.commands, errors: this.errors}))
+  }
+
+  /* Weights arrive during one testcase and are used from the next on. */
+  static storeWeights(data) {
+    try {
+      localStorage.setItem('framboise.weights', data)
+    } catch (e) {
+      logger.error('Unable to store weights: ' + e)
+    }
+  }
+
+  applyWeights(fuzzers) {
+    let weights
+    try {
+      weights = JSON.parse(localStorage.getItem('framboise.weights') || '{}')
+    } catch (e) {
+      return
+    }
+    fuzzers.forEach(fuzzer => {
+      if (weights.hasOwnProperty(fuzzer[2])) {
+        fuzzer[0] = weights[fuzzer[2]]
+      }
+    })
+  }
+}
+
+
 function fuzz_content_sink(cmd, prefs) {
   try {
     logger.log(cmd)
@@ -296,12 +445,28 @@ function fuzz_content_sink(cmd, prefs) {
   } catch (e) {
       //logger.info("ERROR: " + e)
     logger.JSError(e)
+    return e
   }
+  return null
+}
 
+
+/*
+ * Run a captured command log, see libs/py/testcase.py.
+ */
+function replay(commands) {
+  logger.comment('### REPLAY OF ' + commands.length + ' COMMANDS')
+  commands.forEach(cmd => fuzz_content_sink(cmd, {}))
+  logger.comment('### END OF TESTCASE')
 }
 
 
 window.addEventListener('DOMContentLoaded', () => {
+  if ('framboiseReplay' in window) {
+    replay(window.framboiseReplay)
+    return
+  }
+
   framboise = new Framboise()
 
   try {
@@ -0,0 +1,185 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+asyncio based WebSocket server.
+
+All connections are served from a single event loop, frames are read with
+exact-length buffered reads and idle connections do not wake up the process.
+Handlers expose the same API as websocket.BaseWebSocketHandler.
+"""
+import asyncio
+import email.parser
+import logging
+import struct
+import threading
+
+from .websocket import OPCODES, encode_frame, handshake_response, unmask
+
+
+class AsyncWebSocketHandler(object):
+    _opcodes = OPCODES
+
+    def __init__(self, reader, writer, server):
+        self.reader = reader
+        self.writer = writer
+        self.server = server
+
+    async def handle(self):
+        try:
+            request = await self.reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            return
+        request, headers = str(request, 'ascii').split('\r\n', 1)
+        headers = email.parser.HeaderParser().parsestr(headers)
+        # TODO(jschwartzentruber): validate request/headers
+        self.writer.write(handshake_response(headers))
+        self.open()
+        buf = None
+        buf_op = None
+        try:
+            while not self.should_close():
+                try:
+                    data = struct.unpack('BB', await self.reader.readexactly(2))
+                    fin, mask = bool(data[0] & 0x80), bool(data[1] & 0x80)
+                    opcode = self._opcodes[data[0] & 0xF]
+                    length = data[1] & 0x7F
+                    if length == 126:
+                        length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+                    elif length == 127:
+                        length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+                    mask = await self.reader.readexactly(4) if mask else None
+                    data = await self.reader.readexactly(length)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break  # chrome doesn't send a close-frame
+                if opcode == 'close':
+                    break
+                elif opcode == 'pong':
+                    self.on_pong()
+                    continue
+                if mask is not None:
+                    data = unmask(data, mask)
+                if opcode == 'continue':
+                    assert buf is not None
+                    opcode = buf_op
+                elif opcode == 'ping':
+                    self._send(10, data)
+                    continue
+                elif buf is not None:
+                    logging.warning('Received a new frame while waiting for another to finish, '
+                                    'discarding {} bytes of {}'.format(len(buf), buf_op))
+                    buf = buf_op = None
+                if opcode == 'text':
+                    data = str(data, 'utf8')
+                elif opcode == 'binary':
+                    data = bytearray(data)
+                else:
+                    logging.warning('Unknown websocket opcode {}'.format(opcode))
+                    continue
+                if buf is None:
+                    buf = data
+                    buf_op = opcode
+                else:
+                    buf += data
+                if fin:
+                    self.on_message(buf)
+                    buf = buf_op = None
+        finally:
+            self.on_close()
+            self.writer.close()
+
+    def _send(self, opcode, data):
+        self.writer.write(encode_frame(opcode, data))
+
+    # Below is the partial API from tornado.websocket.WebSocketHandler
+    def ping(self):
+        self._send(9, b'')
+
+    def should_close(self):
+        """When this returns true, the message loop will exit."""
+        return False
+
+    def write_message(self, message, binary=False):
+        if binary:
+            self._send(2, message)
+        else:
+            self._send(1, message.encode('utf8'))
+
+    # Event handlers
+    def on_pong(self):
+        pass
+
+    def open(self):
+        pass
+
+    def on_close(self):
+        pass
+
+    def on_message(self, message):
+        raise NotImplementedError('Required method on_message() not implemented.')
+
+
+class AsyncWebSocketServer(object):
+    """
+    Drop-in for TCPServer(addr_port, handler_class) with serve_forever()/shutdown().
+
+    serve_forever() runs the event loop in the calling thread, shutdown() may be
+    called from any other thread.
+    """
+
+    def __init__(self, server_address, handler_class):
+        self.handler_class = handler_class
+        self.loop = asyncio.new_event_loop()
+        # A single host: with host=None and port 0, IPv4 and IPv6 would each
+        # get a different ephemeral port.
+        self.server = self.loop.run_until_complete(asyncio.start_server(
+            self._accept, host=server_address[0] or '127.0.0.1', port=server_address[1],
+            reuse_address=True))
+        self.server_address = self.server.sockets[0].getsockname()
+        self.connections = set()
+        self._serving = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    async def _accept(self, reader, writer):
+        handler = self.handler_class(reader, writer, self)
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            await handler.handle()
+        except asyncio.CancelledError:
+            pass  # server is shutting down
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            self.connections.discard(task)
+
+    def serve_forever(self):
+        with self._lock:
+            if self.loop.is_closed():
+                return  # shut down before it was started
+            self._serving = True
+        try:
+            self.loop.run_forever()
+        finally:
+            self._close()
+
+    def _close(self):
+        self.server.close()
+        for task in self.connections:
+            task.cancel()
+        self.loop.run_until_complete(self.server.wait_closed())
+        if self.connections:
+            self.loop.run_until_complete(asyncio.wait(self.connections))
+        self.loop.close()
+        self._stopped.set()
+
+    def shutdown(self):
+        with self._lock:
+            if self.loop.is_closed():
+                return
+            if not self._serving:
+                self._close()
+                return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._stopped.wait()
@@ -0,0 +1,139 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Compressed, content-addressed storage for crash artifacts.
+
+Blobs are named after the SHA-256 of their uncompressed content, so identical
+testcases and logs are stored once no matter how many faults refer to them.
+Faults keep a small manifest which maps file names to blobs.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ArtifactStore(object):
+
+    CHUNK_SIZE = 64 * 1024
+    EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, path, compression='gzip', level=None):
+        """
+        `compression` is one of 'gzip', 'zstd' or 'none'. Without the zstandard
+        module, 'zstd' falls back to 'gzip'.
+        """
+        if compression not in self.EXTENSIONS:
+            raise ValueError('Unknown compression "{}".'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            logging.warning('zstandard is not installed, compressing artifacts with gzip.')
+            compression = 'gzip'
+        self.path = path
+        self.compression = compression
+        self.level = level
+        folder = os.path.join(path, 'tmp')
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass  # created by another worker
+
+    def blob_path(self, digest, compression):
+        return os.path.join(self.path, digest[:2], digest + self.EXTENSIONS[compression])
+
+    def _writer(self, fo):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=fo, mode='wb', compresslevel=self.level or 6, mtime=0)
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level or 3).stream_writer(fo)
+        return None
+
+    def put(self, chunks):
+        """
+        Store the bytes chunks and return the manifest entry of the blob.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.path, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as fo:
+                writer = self._writer(fo)
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    (writer or fo).write(chunk)
+                if writer is not None:
+                    writer.close()
+            entry = {'sha256': digest.hexdigest(), 'size': size, 'compression': self.compression}
+            path = self.blob_path(entry['sha256'], self.compression)
+            if os.path.exists(path):
+                os.remove(tmp)
+                return dict(entry, duplicate=True)
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass  # created by another worker
+            # Another worker storing the same blob at the same time writes identical content.
+            os.rename(tmp, path)
+            return dict(entry, duplicate=False)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def open(self, entry):
+        """
+        Return a binary file object which decompresses the blob while reading.
+        """
+        path = self.blob_path(entry['sha256'], entry['compression'])
+        if entry['compression'] == 'gzip':
+            return gzip.open(path, 'rb')
+        if entry['compression'] == 'zstd':
+            if zstandard is None:
+                raise IOError('zstandard is required to read "{}".'.format(path))
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return open(path, 'rb')
+
+    def iter_chunks(self, entry):
+        with self.open(entry) as fo:
+            while True:
+                chunk = fo.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def write_manifest(self, folder, files):
+        with open(os.path.join(folder, self.MANIFEST), 'w') as fo:
+            json.dump({'files': files}, fo, indent=1, sort_keys=True)
+
+    @classmethod
+    def read_manifest(cls, folder):
+        """
+        Return {name: entry} of a fault folder or None if it has no manifest.
+        """
+        try:
+            with open(os.path.join(folder, cls.MANIFEST)) as fo:
+                return json.load(fo)['files']
+        except (IOError, OSError):
+            return None
+
+    def export(self, folder, dest):
+        """
+        Write the files listed in the manifest of `folder` uncompressed to `dest`.
+        """
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+        for name, entry in (self.read_manifest(folder) or {}).items():
+            with open(os.path.join(dest, name), 'wb') as fo:
+                for chunk in self.iter_chunks(entry):
+                    fo.write(chunk)
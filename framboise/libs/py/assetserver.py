@@ -0,0 +1,148 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Static HTTP server for the fuzzer page and its assets.
+
+Files are kept in memory after the first request and served with validators,
+so that reloads of the page hit the browser cache or a cheap 304 instead of
+reading modules and media from disk again.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlsplit
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlsplit
+
+
+class AssetCache(object):
+    """
+    In-memory copies of the files below `root`, refreshed when their mtime or
+    size changes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def get(self, path):
+        """
+        Return (data, etag, content type) of a relative path or None.
+        """
+        filename = os.path.join(self.root, path)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        key = (st.st_mtime, st.st_size)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+        with open(filename, 'rb') as fo:
+            data = fo.read()
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        value = (data, '"{}"'.format(hashlib.sha1(data).hexdigest()), content_type)
+        with self.lock:
+            self.files[path] = (key, value)
+        return value
+
+
+class AssetServer(object):
+    """
+    Serves `prefixes` of `root` on 127.0.0.1:`port`; port 0 picks a free one.
+
+    Everything but the page itself may be cached by the browser for `max_age`
+    seconds; the page is revalidated on every load.
+    """
+
+    PREFIXES = ('index.html', 'libs/js/', 'modules/', 'media/', 'replay/', 'bundles/')
+    NO_CACHE = ('index.html',)
+    # Named after their content, never change.
+    IMMUTABLE = ('bundles/',)
+
+    def __init__(self, root, port=0, max_age=3600, prefixes=PREFIXES):
+        self.cache = AssetCache(root)
+        self.port = port
+        self.max_age = max_age
+        self.prefixes = prefixes
+        self.server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def start(self):
+        assets = self
+
+        class AssetHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.respond(body=True)
+
+            def do_HEAD(self):
+                self.respond(body=False)
+
+            def respond(self, body):
+                path = os.path.normpath(unquote(urlsplit(self.path).path)).lstrip('/').replace(os.sep, '/')
+                entry = None
+                if path.startswith(assets.prefixes) and not path.startswith('..'):
+                    entry = assets.cache.get(path)
+                if entry is None:
+                    self.send_error(404)
+                    return
+                data, etag, content_type = entry
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('ETag', etag)
+                if path in assets.NO_CACHE:
+                    self.send_header('Cache-Control', 'no-cache')
+                elif path.startswith(assets.IMMUTABLE):
+                    self.send_header('Cache-Control', 'max-age=31536000, immutable')
+                else:
+                    self.send_header('Cache-Control', 'max-age={}'.format(assets.max_age))
+                self.end_headers()
+                if body:
+                    self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class _HTTPServer(ThreadingMixIn, HTTPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = _HTTPServer(('127.0.0.1', self.port), AssetHandler)
+        thread = threading.Thread(target=self.server.serve_forever, name='AssetServer')
+        thread.daemon = True
+        thread.start()
+        logging.info('Serving fuzzer assets on {}'.format(self.url))
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,93 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Comparison of the outcomes of one testcase stream run against several targets.
+"""
+import collections
+import json
+import logging
+import threading
+import time
+
+
+class DifferentialComparator(object):
+    """
+    Collects per seed which JS exceptions each target raised and whether it
+    crashed, and logs the seeds on which the targets disagree to `path`, one
+    JSON object per line together with the commands of the testcase.
+    """
+
+    # Seeds without outcomes from all targets are dropped after this many newer ones.
+    WINDOW = 1000
+
+    def __init__(self, targets, path):
+        self.targets = targets
+        self.path = path
+        self.lock = threading.Lock()
+        self.batches = collections.OrderedDict()
+        self.outcomes = collections.OrderedDict()
+        self.finished = collections.OrderedDict()
+        self.compared = 0
+        self.divergences = 0
+
+    def add_batch(self, batch):
+        with self.lock:
+            self.batches[batch['seed']] = batch
+            while len(self.batches) > self.WINDOW:
+                seed, _ = self.batches.popitem(last=False)
+                self.outcomes.pop(seed, None)
+
+    def record(self, index, seed, errors):
+        """
+        Account the exception messages target `index` raised for `seed`.
+        """
+        with self.lock:
+            outcome = self.outcomes.setdefault(seed, {}).setdefault(index, {})
+            outcome['errors'] = sorted(set(errors))
+            self._compare(seed)
+
+    def record_crash(self, index, seed, signature):
+        with self.lock:
+            if seed in self.finished:
+                # Crashed after its report, e.g. in a timer; the others did not.
+                outcomes = dict(self.finished[seed])
+                outcomes[index] = dict(outcomes.get(index, {}), crash=signature)
+                self._log(seed, 'crash', outcomes)
+                return
+            outcome = self.outcomes.setdefault(seed, {}).setdefault(index, {})
+            outcome['crash'] = signature
+            self._compare(seed)
+
+    def _compare(self, seed):
+        outcomes = self.outcomes[seed]
+        if len(outcomes) < len(self.targets):
+            return
+        del self.outcomes[seed]
+        self.finished[seed] = outcomes
+        while len(self.finished) > self.WINDOW:
+            self.finished.popitem(last=False)
+        self.compared += 1
+        crashes = set(o.get('crash') for o in outcomes.values())
+        errors = set(tuple(o.get('errors', ())) for o in outcomes.values() if 'crash' not in o)
+        if len(crashes) > 1:
+            self._log(seed, 'crash', outcomes)
+        elif len(errors) > 1:
+            self._log(seed, 'exception', outcomes)
+
+    def _log(self, seed, kind, outcomes):
+        self.divergences += 1
+        batch = self.batches.get(seed, {})
+        entry = {
+            'time': time.time(),
+            'seed': seed,
+            'kind': kind,
+            'targets': dict((self.targets[i], outcome) for i, outcome in outcomes.items()),
+            'commands': batch.get('commands'),
+        }
+        logging.warning('Targets diverge ({}) on seed {}.'.format(kind, seed))
+        try:
+            with open(self.path, 'a') as fo:
+                fo.write(json.dumps(entry, sort_keys=True) + '\n')
+        except IOError as e:
+            logging.exception(e)
@@ -0,0 +1,181 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+A pool of headless X servers for the workers.
+
+Display numbers are taken from BASE upwards, skipping those with an X lock
+file; the X server itself resolves races with other users of a number, so a
+server which exits right away makes us try the next one. Servers are checked
+by connecting to their socket and restarted on their number if they died.
+"""
+import errno
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+
+class Display(object):
+    """
+    One Xvfb server on display :`number`.
+    """
+
+    LOCK = '/tmp/.X{}-lock'
+    SOCKET = '/tmp/.X11-unix/X{}'
+
+    def __init__(self, number, screen, xvfb='Xvfb'):
+        self.number = number
+        self.screen = screen
+        self.xvfb = xvfb
+        self.process = None
+
+    @property
+    def name(self):
+        return ':{}'.format(self.number)
+
+    def in_use(self):
+        """
+        Whether the lock file of the display belongs to a running server;
+        Xvfb removes stale ones itself.
+        """
+        try:
+            with open(self.LOCK.format(self.number)) as fo:
+                pid = int(fo.read().strip())
+        except (IOError, OSError):
+            return False
+        except ValueError:
+            return True
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
+
+    def start(self, timeout=10):
+        """
+        Launch the server and wait until it accepts connections; returns
+        False if it did not come up, e.g. because the display is taken.
+        """
+        cmd = [self.xvfb, self.name, '-screen', '0', self.screen, '-nolisten', 'tcp']
+        with open(os.devnull, 'wb') as devnull:
+            self.process = subprocess.Popen(cmd, stdout=devnull, stderr=devnull,
+                                            close_fds='posix' in sys.builtin_module_names)
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            if self.process.poll() is not None:
+                return False
+            if self.healthy():
+                return True
+            time.sleep(0.05)
+        self.stop()
+        return False
+
+    def healthy(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(1)
+        try:
+            sock.connect(self.SOCKET.format(self.number))
+        except (IOError, OSError):
+            return False
+        finally:
+            sock.close()
+        return True
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            end_time = time.time() + 5
+            while self.process.poll() is None and time.time() < end_time:
+                time.sleep(0.05)
+            if self.process.poll() is None:
+                self.process.kill()
+        self.process.wait()
+
+
+class DisplayPool(object):
+    """
+    One Xvfb server per `per_display` workers.
+    """
+
+    # Display number of xvfb-run.
+    BASE = 99
+    # Display numbers tried per allocation.
+    MAX_TRIES = 100
+    # Seconds between health checks.
+    CHECK_INTERVAL = 10
+
+    def __init__(self, workers, per_display=1, screen='1024x768x24', xvfb='Xvfb'):
+        self.size = -(-workers // per_display)
+        self.per_display = per_display
+        self.screen = screen
+        self.xvfb = xvfb
+        self.displays = []
+        self.restarts = 0
+        self.checked = 0
+
+    def start(self):
+        for _ in range(self.size):
+            self.displays.append(self.allocate())
+        logging.info('Started Xvfb on displays {}.'.format(', '.join(d.name for d in self.displays)))
+
+    def allocate(self, first=None):
+        """
+        Start a server on the first free display number from `first` on.
+        """
+        taken = set(d.number for d in self.displays)
+        number = self.BASE if first is None else first
+        for _ in range(self.MAX_TRIES):
+            display = Display(number, self.screen, self.xvfb)
+            if number not in taken and not display.in_use() and display.start():
+                return display
+            number += 1
+        raise OSError('No free X display between :{} and :{}.'.format(self.BASE, number - 1))
+
+    def display(self, worker):
+        """
+        Return the DISPLAY of a worker number.
+        """
+        return self.displays[worker // self.per_display].name
+
+    def check(self):
+        """
+        Restart servers which exited or, checked every CHECK_INTERVAL seconds,
+        stopped accepting connections on their display number. Returns the
+        indices of the servers which had to move to another number, so that
+        their workers need a restart.
+        """
+        probe = time.time() - self.checked >= self.CHECK_INTERVAL
+        if probe:
+            self.checked = time.time()
+        moved = []
+        for index, display in enumerate(self.displays):
+            if display.process.poll() is None and (not probe or display.healthy()):
+                continue
+            logging.warning('Xvfb on display {} is down, restarting it.'.format(display.name))
+            display.stop()
+            self.restarts += 1
+            if display.start():
+                continue
+            try:
+                self.displays[index] = self.allocate(display.number + 1)
+            except OSError as e:
+                logging.error(e)
+                continue
+            logging.warning('Moved display {} to {}.'.format(display.name, self.displays[index].name))
+            moved.append(index)
+        return moved
+
+    def workers(self, index):
+        return range(index * self.per_display, (index + 1) * self.per_display)
+
+    def stop(self):
+        for display in self.displays:
+            display.stop()
+        self.displays = []
@@ -0,0 +1,181 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Pregeneration of testcases outside of the browser.
+
+A pool of Node.js processes runs libs/js/generator.js, which evaluates the same
+runtime.js and fuzzer modules as the browser, and fills a bounded queue with
+seeded command batches. The browser then only executes the batches it is sent.
+"""
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+class GeneratorError(Exception):
+    pass
+
+
+class CommandGenerator(object):
+
+    def __init__(self, root, config, processes=1, prefetch=16, seed=None, node='node'):
+        """
+        `config` is passed on to generator.js: fuzzers, maxCommands, timeout and
+        the commands switches. Batch seeds count up from `seed` if given, which
+        makes the stream of testcases reproducible, otherwise they are random.
+        """
+        self.root = root
+        self.config = config
+        self.processes = processes
+        self.node = node
+        self.batches = Queue(maxsize=prefetch)
+        self.seeds = itertools.count(int(seed)) if seed is not None else None
+        self.seeds_lock = threading.Lock()
+        self.workers = []
+        self.stopping = False
+        # Module weights from the ModuleScheduler, replacing the '-fuzzer' ones.
+        self.weights = None
+
+    def next_seed(self):
+        with self.seeds_lock:
+            if self.seeds is None:
+                return random.SystemRandom().randint(1, 2 ** 31 - 1)
+            return next(self.seeds)
+
+    def start(self):
+        script = os.path.join(self.root, 'libs', 'js', 'generator.js')
+        for _ in range(self.processes):
+            try:
+                process = subprocess.Popen([self.node, script, json.dumps(self.config)], cwd=self.root,
+                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                           universal_newlines=True, bufsize=1)
+            except OSError as e:
+                self.stop()
+                raise GeneratorError('Unable to run "{}": {}'.format(self.node, e))
+            thread = threading.Thread(target=self.run, args=(process,), name='CommandGenerator')
+            thread.daemon = True
+            self.workers.append((process, thread))
+            thread.start()
+        logging.info('Pregenerating testcases with {} generator processes.'.format(self.processes))
+
+    def run(self, process):
+        while not self.stopping:
+            seed = self.next_seed()
+            request = {'seed': seed}
+            if self.weights is not None:
+                request['weights'] = self.weights
+            try:
+                process.stdin.write(json.dumps(request) + '\n')
+                process.stdin.flush()
+                line = process.stdout.readline()
+            except (IOError, OSError, ValueError):
+                line = ''
+            if not line:
+                if not self.stopping:
+                    logging.error('Generator process exited with code {}.'.format(process.poll()))
+                    self.batches.put(None)
+                return
+            batch = json.loads(line)
+            if 'error' in batch:
+                logging.error('Generating seed {} failed: {}'.format(seed, batch['error']))
+                continue
+            self.batches.put(batch)
+
+    def next(self, timeout=None):
+        """
+        Return the next batch as a dict with seed, reloadTimeout and commands.
+        """
+        batch = self.batches.get(timeout=timeout)
+        if batch is None:
+            raise GeneratorError('Generator process died.')
+        return batch
+
+    def stop(self):
+        self.stopping = True
+        for process, _ in self.workers:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        # Unblock generator threads waiting for free queue slots.
+        while not self.batches.empty():
+            self.batches.get_nowait()
+        self.workers = []
+
+
+class BatchFanout(object):
+    """
+    Hands the same stream of batches to several targets, e.g. for differential
+    runs. Targets which fall more than MAX_LAG batches behind the fastest one,
+    e.g. while restarting, skip ahead instead of slowing the others down.
+    """
+
+    MAX_LAG = 64
+
+    def __init__(self, generator, targets, on_batch=None):
+        self.generator = generator
+        self.on_batch = on_batch
+        self.lock = threading.Lock()
+        self.batches = []
+        self.offset = 0
+        self.cursors = [0] * targets
+
+    def next(self, index, timeout=None):
+        with self.lock:
+            position = max(self.cursors[index], max(self.cursors) - self.MAX_LAG)
+            if position - self.offset >= len(self.batches):
+                batch = self.generator.next(timeout)
+                self.batches.append(batch)
+                if self.on_batch is not None:
+                    self.on_batch(batch)
+            batch = self.batches[position - self.offset]
+            self.cursors[index] = position + 1
+            while self.batches and self.offset < min(self.cursors):
+                self.batches.pop(0)
+                self.offset += 1
+            # Keep the window bounded even if a target never asks again.
+            while len(self.batches) > self.MAX_LAG + 1:
+                self.batches.pop(0)
+                self.offset += 1
+            return batch
+
+    def view(self, index):
+        return FanoutView(self, index)
+
+
+class FanoutView(object):
+    """
+    The batch stream of one target, with the interface of CommandGenerator.
+    """
+
+    def __init__(self, fanout, index):
+        self.fanout = fanout
+        self.index = index
+        self.current = None
+
+    @property
+    def weights(self):
+        return self.fanout.generator.weights
+
+    @weights.setter
+    def weights(self, weights):
+        self.fanout.generator.weights = weights
+
+    def next(self, timeout=None):
+        self.current = self.fanout.next(self.index, timeout)
+        return self.current
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
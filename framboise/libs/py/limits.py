@@ -0,0 +1,161 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Memory and CPU caps for target processes.
+
+Each worker gets its own cgroup v2 group below `cgroup` (default: a 'framboise'
+group in the root of the unified hierarchy) into which its targets are moved
+before they exec, so that content processes they spawn are capped as well.
+Where cgroup v2 is not available or not writable, the address space of the
+target can be limited with RLIMIT_AS instead if `fallback` is set; that limit
+applies per process and does not work with ASan builds, which reserve
+terabytes of shadow memory.
+
+The limits are applied by a shell which execs the target, not by a Popen
+preexec_fn: the client runs monitor threads, and forking with them is only
+safe if the child execs right away.
+"""
+import atexit
+import logging
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+
+
+class ResourceLimits(object):
+
+    CGROUP_ROOT = '/sys/fs/cgroup'
+    # cpu.max period in microseconds.
+    CPU_PERIOD = 100000
+
+    def __init__(self, memory=None, cpu=None, swap=0, cgroup=None, fallback=False, name=None):
+        """
+        `memory` and `swap` are in MB, `cpu` in percent of one core (200: two
+        cores). `fallback` allows RLIMIT_AS if no cgroup can be created, which
+        breaks ASan builds.
+        """
+        self.name = name or 'worker-{}'.format(os.getpid())
+        self.memory = memory
+        self.cpu = cpu
+        self.swap = swap
+        self.parent = cgroup or os.path.join(self.CGROUP_ROOT, 'framboise')
+        self.fallback = fallback
+        self.path = None
+        self.oom_baseline = 0
+        self.mode = None
+
+    @classmethod
+    def from_config(cls, config, name=None):
+        """
+        Build the limits of a setup from its 'limits' entry, None if unset.
+        """
+        if not config or not (config.get('memory') or config.get('cpu')):
+            return None
+        return cls(name=name, **config)
+
+    def prepare(self):
+        """
+        Create or reuse the cgroup of this worker; called before every launch.
+        """
+        if self.mode is None:
+            self.mode = self._create_cgroup() or self._check_rlimit()
+        if self.mode == 'cgroup':
+            self.oom_baseline = self._oom_kills()
+
+    def _create_cgroup(self):
+        if not os.path.exists(os.path.join(self.CGROUP_ROOT, 'cgroup.controllers')) and \
+                not os.path.exists(os.path.join(self.parent, 'cgroup.controllers')):
+            return None
+        path = os.path.join(self.parent, self.name)
+        try:
+            if not os.path.isdir(self.parent):
+                os.makedirs(self.parent)
+            with open(os.path.join(self.parent, 'cgroup.subtree_control'), 'w') as fo:
+                fo.write('+memory +cpu')
+            if not os.path.isdir(path):
+                os.mkdir(path)
+            if self.memory:
+                self._write(path, 'memory.max', int(self.memory) * 1024 * 1024)
+                self._write(path, 'memory.swap.max', int(self.swap) * 1024 * 1024)
+            if self.cpu:
+                self._write(path, 'cpu.max', '{} {}'.format(int(self.CPU_PERIOD * self.cpu / 100.0), self.CPU_PERIOD))
+        except (IOError, OSError) as e:
+            logging.warning('Unable to set up cgroup {}: {}'.format(path, e))
+            return None
+        self.path = path
+        atexit.register(self.release)
+        logging.info('Target limits: cgroup {} (memory: {} MB, cpu: {}%).'.format(path, self.memory, self.cpu))
+        return 'cgroup'
+
+    def _check_rlimit(self):
+        if not self.fallback or resource is None or not self.memory:
+            logging.warning('Target limits unavailable, running without them.')
+            return 'none'
+        if self.cpu:
+            logging.warning('CPU limit needs cgroup v2, ignoring it.')
+        logging.info('Target limits: RLIMIT_AS of {} MB per process.'.format(self.memory))
+        return 'rlimit'
+
+    @staticmethod
+    def _write(path, name, value):
+        with open(os.path.join(path, name), 'w') as fo:
+            fo.write(str(value))
+
+    def wrap(self, cmd):
+        """
+        Prefix `cmd` with a shell which applies the limits and execs it.
+        """
+        if self.mode == 'cgroup':
+            setup = 'echo $$ > "$0"'
+            arg = os.path.join(self.path, 'cgroup.procs')
+        elif self.mode == 'rlimit':
+            setup = 'ulimit -v "$0"'
+            arg = str(int(self.memory) * 1024)
+        else:
+            return cmd
+        return ['/bin/sh', '-c', setup + ' && exec "$@"', arg] + list(cmd)
+
+    def _oom_kills(self):
+        try:
+            with open(os.path.join(self.path, 'memory.events')) as fo:
+                for line in fo:
+                    key, value = line.split()
+                    if key == 'oom_kill':
+                        return int(value)
+        except (IOError, OSError, ValueError):
+            pass
+        return 0
+
+    def oom_killed(self):
+        """
+        Number of processes the kernel killed for exceeding the memory limit
+        since the last launch.
+        """
+        if self.mode != 'cgroup':
+            return 0
+        return self._oom_kills() - self.oom_baseline
+
+    def peak_memory(self):
+        """
+        Highest memory usage of the cgroup in bytes, None if unknown.
+        """
+        if self.mode != 'cgroup':
+            return None
+        try:
+            with open(os.path.join(self.path, 'memory.peak')) as fo:
+                return int(fo.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def release(self):
+        if self.path is None:
+            return
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass  # still populated
+        self.path = None
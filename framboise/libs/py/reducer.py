@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Delta debugging (ddmin) with candidates evaluated in parallel.
+"""
+import hashlib
+import logging
+import multiprocessing
+
+
+class Reducer(object):
+
+    def __init__(self, test, processes=1):
+        """
+        `test(items)` returns True if the failure still reproduces. It is run in a
+        pool of `processes` and therefore has to be picklable, i.e. a module-level
+        function or a functools.partial of one.
+        """
+        self.test = test
+        self.processes = processes
+        self.cache = {}
+        self.tests = 0
+
+    @staticmethod
+    def _key(items):
+        return hashlib.sha1(u'\n'.join(items).encode('utf-8')).hexdigest()
+
+    def evaluate(self, pool, candidates):
+        """
+        Return the index of the first reproducing candidate or None.
+
+        Candidates are tested in parallel; results are cached by content, so
+        subsets which come up again in later rounds are not replayed.
+        """
+        pending = {}
+        for candidate in candidates:
+            key = self._key(candidate)
+            if key not in self.cache and key not in pending:
+                pending[key] = candidate
+        if pending:
+            keys = list(pending)
+            self.tests += len(keys)
+            for key, result in zip(keys, pool.map(self.test, [pending[k] for k in keys], chunksize=1)):
+                self.cache[key] = result
+        for i, candidate in enumerate(candidates):
+            if self.cache[self._key(candidate)]:
+                return i
+        return None
+
+    @staticmethod
+    def split(items, n):
+        size, extra = divmod(len(items), n)
+        chunks, start = [], 0
+        for i in range(n):
+            end = start + size + (1 if i < extra else 0)
+            chunks.append(items[start:end])
+            start = end
+        return chunks
+
+    def reduce(self, items):
+        """
+        Return a 1-minimal subsequence of `items` which still reproduces.
+        """
+        items = list(items)
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            n = 2
+            while len(items) >= 2:
+                chunks = self.split(items, n)
+                complements = []
+                if n > 2:
+                    complements = [[x for j, chunk in enumerate(chunks) if j != i for x in chunk]
+                                   for i in range(n)]
+                found = self.evaluate(pool, chunks + complements)
+                if found is not None and found < n:
+                    items, n = chunks[found], 2
+                elif found is not None:
+                    items, n = complements[found - n], max(n - 1, 2)
+                elif n >= len(items):
+                    break
+                else:
+                    n = min(len(items), n * 2)
+                logging.info('Reducer: {} items left, granularity {}, {} replays.'.format(
+                    len(items), n, self.tests))
+        finally:
+            pool.terminate()
+            pool.join()
+        return items
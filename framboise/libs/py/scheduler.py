@@ -0,0 +1,92 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Adaptive weighting of fuzzer modules.
+
+runtime.js reports per testcase how many commands each module emitted and
+which JS exceptions they raised. A module earns credit for exceptions it has
+not raised before and, much more, for crash signatures not seen before; old
+credit decays. Weights are the '-fuzzer' weights scaled by each module's
+recent productivity relative to the others, with a floor so that no module
+is ever starved.
+"""
+import threading
+
+
+class ModuleScheduler(object):
+
+    # Credit of a new crash signature relative to a new JS exception.
+    CRASH_REWARD = 50
+    # Share of the credit and command counts kept per update.
+    DECAY = 0.8
+    # A module keeps at least this share of its configured weight.
+    FLOOR = 0.1
+    # Weights are integers in runtime.js, this keeps their resolution.
+    SCALE = 100
+
+    def __init__(self, fuzzers):
+        """
+        `fuzzers` is the '-fuzzer' list, e.g. '1:Canvas2D,3:WebAudio'.
+        """
+        self.lock = threading.Lock()
+        self.base = {}
+        for pair in fuzzers.split(','):
+            weight, name = pair.split(':')
+            self.base[name] = int(weight)
+        self.commands = dict.fromkeys(self.base, 0.0)
+        self.credit = dict.fromkeys(self.base, 0.0)
+        self.errors = dict((name, set()) for name in self.base)
+        self.signatures = set()
+        self.last_modules = list(self.base)
+        self.testcases = 0
+
+    def record_testcase(self, report):
+        """
+        Account a '/*W*/' report: {"commands": {module: n}, "errors": {module: {message: n}}}.
+        """
+        with self.lock:
+            self.testcases += 1
+            modules = []
+            for name, count in report.get('commands', {}).items():
+                if name in self.base:
+                    self.commands[name] += count
+                    modules.append(name)
+            for name, messages in report.get('errors', {}).items():
+                if name not in self.base:
+                    continue
+                new = set(messages) - self.errors[name]
+                self.errors[name].update(new)
+                self.credit[name] += len(new)
+            if modules:
+                self.last_modules = modules
+
+    def record_fault(self, signature):
+        """
+        Credit the modules of the last reported testcase for a new crash signature.
+        """
+        with self.lock:
+            if signature is None or signature in self.signatures:
+                return False
+            self.signatures.add(signature)
+            for name in self.last_modules:
+                self.credit[name] += float(self.CRASH_REWARD) / len(self.last_modules)
+            return True
+
+    def update(self):
+        """
+        Return the new {module: weight} and decay the accumulated signals.
+        """
+        with self.lock:
+            scores = {}
+            for name in self.base:
+                # New findings per thousand commands, smoothed for idle modules.
+                scores[name] = (self.credit[name] + 1) / (self.commands[name] / 1000.0 + 1)
+            mean = sum(scores.values()) / len(scores)
+            weights = {}
+            for name, base in self.base.items():
+                share = max(self.FLOOR, scores[name] / mean)
+                weights[name] = max(1, int(round(base * share * self.SCALE)))
+                self.credit[name] *= self.DECAY
+                self.commands[name] *= self.DECAY
+            return weights
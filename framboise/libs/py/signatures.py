@@ -0,0 +1,142 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Crash signatures built from AddressSanitizer reports and a host-wide index of
+the signatures seen so far, shared by all workers through SQLite.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+
+ASAN_ERROR = re.compile(r'ERROR: AddressSanitizer: ([\w-]+)')
+ASAN_ACCESS = re.compile(r'^(READ|WRITE) of size')
+# '#3 0x7f3c2a in Foo::Bar(int) /src/foo.cpp:12:3' or '#3 0x7f3c2a (/lib/libxul.so+0x12ab)'
+ASAN_FRAME = re.compile(r'^#(\d+)\s+0x[0-9a-fA-F]+\s+(?:in\s+(.*?))?(?:\s*\(([^()]*?)\+0x[0-9a-fA-F]+\))?(?:\s+\S*[/\\]\S*)?$')
+# Frames of the sanitizer runtime itself are the same for every crash.
+IGNORED_FRAMES = re.compile(r'^(__asan|__sanitizer|__interceptor_|__lsan|__ubsan)')
+
+
+def crash_signature(lines, frames=5):
+    """
+    Return (signature, description) for the top `frames` frames of the first
+    stack in an ASan report, or (None, None) if no report was found.
+    """
+    kind = None
+    stack = []
+    in_stack = False
+    for line in lines:
+        line = line.strip()
+        if kind is None:
+            match = ASAN_ERROR.search(line)
+            if match:
+                kind = match.group(1)
+            continue
+        match = ASAN_ACCESS.match(line)
+        if match and not in_stack:
+            kind = '{} {}'.format(kind, match.group(1))
+            continue
+        match = ASAN_FRAME.match(line)
+        if match is None:
+            if in_stack and (not line or line.startswith('SUMMARY:')):
+                break  # end of the first stack
+            continue  # e.g. console output of the page interleaved with the report
+        if in_stack and match.group(1) == '0':
+            break
+        in_stack = True
+        function = match.group(2) or os.path.basename(match.group(3) or '') or '??'
+        if IGNORED_FRAMES.match(function):
+            continue
+        stack.append(function)
+        if len(stack) >= frames:
+            break
+    if kind is None:
+        return None, None
+    description = '{}: {}'.format(kind, ' | '.join(stack))
+    return hashlib.sha1(description.encode('UTF-8')).hexdigest(), description
+
+
+class SignatureIndex(object):
+    """
+    Persistent per-host counters of crash signatures.
+
+    A signature is submitted the first `max_submissions` times it is seen,
+    afterwards at most once per `resubmit_interval` seconds (never if None).
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS signatures (
+            signature TEXT PRIMARY KEY,
+            description TEXT,
+            hits INTEGER NOT NULL DEFAULT 0,
+            submissions INTEGER NOT NULL DEFAULT 0,
+            first_seen REAL,
+            last_seen REAL,
+            last_submitted REAL
+        )
+    '''
+
+    def __init__(self, path, max_submissions=1, resubmit_interval=None):
+        self.path = path
+        self.max_submissions = max_submissions
+        self.resubmit_interval = resubmit_interval
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass  # created by another worker
+        db = self._connect()
+        try:
+            db.execute(self.SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def record(self, signature, description):
+        """
+        Count a hit of `signature` and return (hits, should_submit).
+        """
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT hits, submissions, last_submitted FROM signatures WHERE signature = ?',
+                             (signature,)).fetchone()
+            hits, submissions, last_submitted = row if row else (0, 0, None)
+            hits += 1
+            submit = submissions < self.max_submissions
+            if not submit and self.resubmit_interval is not None:
+                # No time if the last submission was released.
+                submit = last_submitted is None or now - last_submitted >= self.resubmit_interval
+            if submit:
+                submissions += 1
+                last_submitted = now
+            db.execute('INSERT OR REPLACE INTO signatures '
+                       '(signature, description, hits, submissions, first_seen, last_seen, last_submitted) '
+                       'VALUES (?, ?, ?, ?, COALESCE((SELECT first_seen FROM signatures WHERE signature = ?), ?), ?, ?)',
+                       (signature, description, hits, submissions, signature, now, now, last_submitted))
+            db.execute('COMMIT')
+        except Exception:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+        return hits, submit
+
+    def release(self, signature):
+        """
+        Take back a submission counted by record() which never made it.
+        """
+        db = self._connect()
+        try:
+            db.execute('UPDATE signatures SET submissions = MAX(submissions - 1, 0), last_submitted = NULL '
+                       'WHERE signature = ?', (signature,))
+        finally:
+            db.close()
@@ -0,0 +1,124 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Bounded line buffer which keeps the newest data in memory and spills older
+segments to an anonymous temporary file.
+"""
+import collections
+import os
+import tempfile
+import threading
+
+
+class SpillBuffer(object):
+    """
+    Collects lines joined by `separator` as UTF-8 encoded bytes.
+
+    At most `max_memory` bytes are held in memory; once exceeded, the oldest
+    `segment_size` chunks are appended to a temporary file. Reading streams the
+    spilled part from disk followed by the in-memory segments.
+
+    Appending and reading may happen on different threads: readers see the
+    data buffered when they started and read the spill file with os.pread
+    where available, so they never move the position the writer appends at;
+    elsewhere, e.g. on Windows, reads seek under the lock.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, max_memory=8 * 1024 * 1024, segment_size=256 * 1024, separator=os.linesep):
+        self.max_memory = max_memory
+        self.segment_size = min(segment_size, max_memory)
+        self.separator = separator.encode('utf-8')
+        self.segments = collections.deque()
+        self.memory = 0
+        self.spilled = 0
+        self.lines = 0
+        self.spill = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.spilled + self.memory
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    def append(self, line):
+        data = line.encode('utf-8')
+        with self.lock:
+            if self.lines:
+                data = self.separator + data
+            self.lines += 1
+            if not self.segments or len(self.segments[-1]) >= self.segment_size:
+                self.segments.append(bytearray())
+            self.segments[-1].extend(data)
+            self.memory += len(data)
+            while self.memory > self.max_memory and len(self.segments) > 1:
+                self._spill(self.segments.popleft())
+
+    def _spill(self, segment):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(prefix='framboise_')
+        self.spill.seek(0, os.SEEK_END)
+        self.spill.write(segment)
+        self.spill.flush()
+        self.spilled += len(segment)
+        self.memory -= len(segment)
+
+    def clear(self):
+        with self.lock:
+            self.segments.clear()
+            self.memory = 0
+            self.spilled = 0
+            self.lines = 0
+            if self.spill is not None:
+                self.spill.close()
+                self.spill = None
+
+    def iter_chunks(self):
+        """
+        Yield the buffered bytes in order, reading spilled data from disk.
+        """
+        with self.lock:
+            spill = self.spill
+            spilled = self.spilled
+            segments = [bytes(segment) for segment in self.segments]
+        offset = 0
+        while offset < spilled:
+            with self.lock:
+                if self.spill is not spill:
+                    return  # cleared meanwhile
+                size = min(self.CHUNK_SIZE, spilled - offset)
+                if hasattr(os, 'pread'):
+                    chunk = os.pread(spill.fileno(), size, offset)
+                else:
+                    spill.seek(offset)
+                    chunk = spill.read(size)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+        for segment in segments:
+            yield segment
+
+    __iter__ = iter_chunks
+
+    def iter_lines(self):
+        """
+        Yield the buffered lines decoded, without joining the whole buffer.
+        """
+        count = self.lines
+        pending = b''
+        for chunk in self.iter_chunks():
+            lines = (pending + chunk).split(self.separator)
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8', 'replace')
+        if pending or count:
+            yield pending.decode('utf-8', 'replace')
+
+    def getvalue(self):
+        return b''.join(self.iter_chunks())
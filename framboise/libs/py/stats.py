@@ -0,0 +1,248 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Throughput metrics of a fuzzing host.
+
+Each worker process records counters, gauges and latency histograms in the
+module-level `registry` and periodically flushes a snapshot to the stats
+folder. The supervisor merges the snapshots of all workers into a JSON stats
+file and serves them in the Prometheus text format.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+PREFIX = 'framboise_'
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.flusher = None
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time.time(),
+                'pid': os.getpid(),
+                'counters': [[n, dict(l), v] for (n, l), v in self.counters.items()],
+                'gauges': [[n, dict(l), v] for (n, l), v in self.gauges.items()],
+                'histograms': [[n, dict(l), dict(h, buckets=list(h['buckets']))]
+                               for (n, l), h in self.histograms.items()],
+            }
+
+    def flush(self, path):
+        write_json(path, self.snapshot())
+
+    def start_flushing(self, path, interval=10):
+        """
+        Write a snapshot to `path` every `interval` seconds from a daemon thread.
+        """
+        def flush_forever():
+            while True:
+                try:
+                    self.flush(path)
+                except (IOError, OSError) as e:
+                    logging.error('Unable to write stats: {}'.format(e))
+                time.sleep(interval)
+
+        self.flusher = threading.Thread(target=flush_forever, name='StatsFlusher')
+        self.flusher.daemon = True
+        self.flusher.start()
+
+
+registry = Registry()
+
+
+def write_json(path, data):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as fo:
+        json.dump(data, fo, indent=1, sort_keys=True)
+    try:
+        os.replace(tmp, path)
+    except AttributeError:
+        # Python 2
+        os.rename(tmp, path)
+
+
+def read_snapshots(folder):
+    """
+    Return {worker: snapshot} for all worker snapshots in `folder`.
+    """
+    snapshots = {}
+    for name in sorted(os.listdir(folder)):
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(folder, name)) as fo:
+                snapshots[name[len('worker-'):-len('.json')]] = json.load(fo)
+        except (IOError, OSError, ValueError):
+            continue
+    return snapshots
+
+
+def summarize(snapshots):
+    """
+    Sum up the counters of all workers, ignoring labels. Gauges such as module
+    weights or queue depths do not add up; they stay in the worker snapshots.
+    """
+    totals = {}
+    for snapshot in snapshots.values():
+        for name, labels, value in snapshot['counters']:
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                                    for k, v in sorted(labels.items())))
+
+
+def render_prometheus(snapshots, extra=None):
+    """
+    Render worker snapshots and `extra` [(name, labels, value)] gauges as
+    Prometheus text exposition format.
+    """
+    series = {}
+    for worker, snapshot in snapshots.items():
+        for kind in ('counters', 'gauges', 'histograms'):
+            for name, labels, value in snapshot[kind]:
+                series.setdefault((kind, name), []).append((dict(labels, worker=worker), value))
+    for name, labels, value in extra or ():
+        series.setdefault(('gauges', name), []).append((labels, value))
+
+    lines = []
+    types = {'counters': 'counter', 'gauges': 'gauge', 'histograms': 'histogram'}
+    for (kind, name), samples in sorted(series.items()):
+        name = PREFIX + name
+        lines.append('# TYPE {} {}'.format(name, types[kind]))
+        for labels, value in samples:
+            if kind != 'histograms':
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+                continue
+            for bound, count in zip(BUCKETS, value['buckets']):
+                lines.append('{}_bucket{} {}'.format(name, _labels(dict(labels, le=bound)), count))
+            lines.append('{}_bucket{} {}'.format(name, _labels(dict(labels, le='+Inf')), value['count']))
+            lines.append('{}_sum{} {}'.format(name, _labels(labels), value['sum']))
+            lines.append('{}_count{} {}'.format(name, _labels(labels), value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+class StatsAggregator(object):
+    """
+    Merges worker snapshots from `folder` into `folder`/stats.json every
+    `interval` seconds and optionally serves /metrics on localhost:`port`.
+
+    `extra` is a callable returning additional (name, labels, value) gauges, e.g.
+    the supervisor's per-worker launch counters.
+    """
+
+    def __init__(self, folder, interval=10, port=None, extra=None):
+        self.folder = folder
+        self.interval = interval
+        self.port = port
+        self.extra = extra or (lambda: [])
+        self.server = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='StatsAggregator')
+        thread.daemon = True
+        thread.start()
+        if self.port is not None:
+            self.serve(self.port)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        snapshots = read_snapshots(self.folder)
+        try:
+            write_json(os.path.join(self.folder, 'stats.json'), {
+                'time': time.time(),
+                'total': summarize(snapshots),
+                'supervisor': [[n, l, v] for n, l, v in self.extra()],
+                'workers': snapshots,
+            })
+        except (IOError, OSError) as e:
+            logging.error('Unable to write stats: {}'.format(e))
+
+    def serve(self, port):
+        aggregator = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render_prometheus(read_snapshots(aggregator.folder), aggregator.extra()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class _HTTPServer(ThreadingMixIn, HTTPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = _HTTPServer(('127.0.0.1', port), MetricsHandler)
+        thread = threading.Thread(target=self.server.serve_forever, name='StatsServer')
+        thread.daemon = True
+        thread.start()
+        logging.info('Serving metrics on http://127.0.0.1:{}/metrics'.format(self.server.server_address[1]))
+
+    def stop(self):
+        self.stopping.set()
+        self.flush()
+        if self.server is not None:
+            self.server.shutdown()
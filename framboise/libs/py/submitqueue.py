@@ -0,0 +1,191 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+On-disk submission queue drained by a background uploader thread.
+
+Entries are directories which move atomically between the sub-folders of the
+queue: tmp -> pending -> inflight -> (deleted | pending | failed). The queue
+survives restarts of the worker and may be shared by several processes.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+class SubmissionQueue(object):
+
+    ENTRY_META = 'entry.json'
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, submit, batch_size=10, interval=5, max_retries=5,
+                 backoff=30, max_backoff=3600, stale_after=600, on_failed=None):
+        """
+        `submit(entry_path, meta)` uploads a single entry and returns True on
+        success. Failed entries are retried with an exponential backoff and moved
+        to 'failed' after `max_retries` attempts, calling `on_failed(entry_path,
+        meta)` first. Entries claimed by an uploader which did not finish within
+        `stale_after` seconds are returned to pending.
+        """
+        self.path = path
+        self.submit = submit
+        self.on_failed = on_failed
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stale_after = stale_after
+        for folder in ('tmp', 'pending', 'inflight', 'failed'):
+            folder = os.path.join(path, folder)
+            if not os.path.isdir(folder):
+                try:
+                    os.makedirs(folder)
+                except OSError:
+                    pass  # created by another worker
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    @classmethod
+    def instance(cls, path, submit, **kwargs):
+        """
+        Return the uploader for `path` in this process, starting it if needed.
+        """
+        with cls._instances_lock:
+            queue = cls._instances.get(path)
+            if queue is None:
+                queue = cls._instances[path] = cls(path, submit, **kwargs)
+                queue.start()
+            return queue
+
+    @classmethod
+    def stop_all(cls, timeout=None):
+        """
+        Stop the uploaders of this process; entries left inflight are picked up
+        again by the next uploader once they are stale.
+        """
+        with cls._instances_lock:
+            queues = list(cls._instances.values())
+            cls._instances.clear()
+        for queue in queues:
+            queue.stop(timeout)
+
+    def _folder(self, name, *parts):
+        return os.path.join(self.path, name, *parts)
+
+    def reserve(self):
+        """
+        Create an entry folder to fill; hand it to put() when complete.
+        """
+        entry = '{:.6f}-{}'.format(time.time(), uuid.uuid4().hex)
+        os.makedirs(self._folder('tmp', entry))
+        return self._folder('tmp', entry)
+
+    def put(self, entry_path, meta):
+        meta = dict(meta, attempts=0, not_before=0)
+        with open(os.path.join(entry_path, self.ENTRY_META), 'w') as fo:
+            json.dump(meta, fo)
+        os.rename(entry_path, self._folder('pending', os.path.basename(entry_path)))
+        self.wakeup.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='SubmissionQueue')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopping:
+            try:
+                self.recover()
+                while not self.stopping and self.drain():
+                    pass
+            except Exception as e:
+                logging.exception(e)
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def pending(self):
+        return len(os.listdir(self._folder('pending')))
+
+    def recover(self):
+        """
+        Return entries of uploaders which died while submitting to pending.
+        """
+        now = time.time()
+        for entry in os.listdir(self._folder('inflight')):
+            path = self._folder('inflight', entry)
+            try:
+                if now - os.path.getmtime(path) >= self.stale_after:
+                    os.rename(path, self._folder('pending', entry))
+            except OSError:
+                pass  # recovered by someone else
+
+    def _claim(self):
+        now = time.time()
+        claimed = []
+        for entry in sorted(os.listdir(self._folder('pending'))):
+            if len(claimed) >= self.batch_size:
+                break
+            meta = self._read_meta(self._folder('pending', entry))
+            if meta is None or meta.get('not_before', 0) > now:
+                continue
+            try:
+                os.rename(self._folder('pending', entry), self._folder('inflight', entry))
+            except OSError:
+                continue  # claimed by another uploader
+            os.utime(self._folder('inflight', entry), None)
+            claimed.append((entry, meta))
+        return claimed
+
+    def _read_meta(self, path):
+        try:
+            with open(os.path.join(path, self.ENTRY_META)) as fo:
+                return json.load(fo)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def drain(self):
+        """
+        Submit one batch of ready entries, return the number processed.
+        """
+        batch = self._claim()
+        for entry, meta in batch:
+            path = self._folder('inflight', entry)
+            try:
+                success = self.submit(path, meta)
+            except Exception as e:
+                logging.exception(e)
+                success = False
+            if success:
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            meta['attempts'] += 1
+            if meta['attempts'] >= self.max_retries:
+                logging.error('Giving up on submission {} after {} attempts.'.format(entry, meta['attempts']))
+                if self.on_failed is not None:
+                    try:
+                        self.on_failed(path, meta)
+                    except Exception as e:
+                        logging.exception(e)
+                os.rename(path, self._folder('failed', entry))
+                continue
+            delay = min(self.backoff * 2 ** (meta['attempts'] - 1), self.max_backoff)
+            meta['not_before'] = time.time() + delay
+            logging.warning('Submission {} failed, retrying in {}s.'.format(entry, delay))
+            with open(os.path.join(path, self.ENTRY_META), 'w') as fo:
+                json.dump(meta, fo)
+            os.rename(path, self._folder('pending', entry))
+        return len(batch)
@@ -0,0 +1,83 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Command logs as captured by TestcaseListener and standalone HTML built from them.
+"""
+import io
+import json
+
+HTML_TEMPLATE = u'''<!DOCTYPE html>
+<html>
+    <head>
+        <meta content="text/html;charset=utf-8" http-equiv="content-type">
+        <title>Framboise Testcase</title>
+    </head>
+    <body>
+        <script type="text/javascript">
+            /* Every command runs on its own, like fuzz_content_sink() in runtime.js. */
+            window.addEventListener('DOMContentLoaded', () => {{
+                {commands}.forEach(cmd => {{
+                    try {{
+                        eval(cmd)
+                    }} catch (e) {{
+                    }}
+                }})
+            }}, false)
+        </script>
+    </body>
+</html>
+'''
+
+# Replays through runtime.js, so that octo.js is available and the commands are
+# logged like during fuzzing. `root` is the path to the folder of index.html.
+RUNTIME_TEMPLATE = u'''<!DOCTYPE html>
+<html>
+    <head>
+        <meta content="text/html;charset=utf-8" http-equiv="content-type">
+        <title>Framboise Testcase</title>
+        <script type="text/javascript">
+            var framboiseReplay = {commands}
+        </script>
+        <script type="text/javascript" src="{root}libs/js/octo.js"></script>
+        <script type="text/javascript" src="{root}libs/js/runtime.js"></script>
+    </head>
+    <body>
+    </body>
+</html>
+'''
+
+
+def read_commands(path):
+    """
+    Return the commands of a testcase.txt, one per logged line.
+    """
+    with io.open(path, encoding='utf-8', errors='replace') as fo:
+        return parse_commands(fo.read())
+
+
+def parse_commands(text):
+    return [line[1:] if line.startswith(' ') else line
+            for line in text.splitlines() if line.strip()]
+
+
+def write_commands(path, commands):
+    with io.open(path, 'w', encoding='utf-8') as fo:
+        fo.write(u'\n'.join(commands) + u'\n')
+
+
+def build_html(commands, root=None):
+    """
+    Standalone page running `commands`; with `root` it loads the runtime from
+    the framboise folder at that (relative) URL.
+    """
+    # '</' must not end the script element early.
+    data = json.dumps(list(commands), indent=1).replace('</', '<\\/')
+    if root is None:
+        return HTML_TEMPLATE.format(commands=data)
+    return RUNTIME_TEMPLATE.format(commands=data, root=root)
+
+
+def write_html(path, commands, root=None):
+    with io.open(path, 'w', encoding='utf-8') as fo:
+        fo.write(build_html(commands, root))
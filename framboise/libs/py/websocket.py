@@ -15,21 +15,106 @@ try:
 except ImportError:
     # python 2
     from SocketServer import BaseRequestHandler
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this size the NumPy call overhead outweighs the vectorized XOR.
+NUMPY_MIN_LENGTH = 1024
+
+
+OPCODES = {
+    0: 'continue',
+    1: 'text',
+    2: 'binary',
+    8: 'close',
+    9: 'ping',
+    10: 'pong'
+}
+
+str_t = str if sys.version_info[0] == 3 else lambda a, b: str(a).encode(b)
+
+
+def handshake_response(headers):
+    """Build the '101 Switching Protocols' reply for the parsed request headers."""
+    hresponse = hashlib.sha1(headers['sec-websocket-key'].encode('ascii'))
+    hresponse.update(b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11')
+    resp = email.message.Message()
+    resp.add_header('Upgrade', 'websocket')
+    resp.add_header('Connection', 'Upgrade')
+    resp.add_header('Sec-WebSocket-Accept', str_t(base64.b64encode(hresponse.digest()), 'ascii'))
+    resp = resp.as_string(unixfrom=False).replace('\n', '\r\n')
+    return 'HTTP/1.1 101 Switching Protocols\r\n{}'.format(resp).encode('ascii')
+
+
+def unmask(data, mask):
+    """
+    XOR a frame payload with its 4-byte masking key.
+
+    With NumPy, larger payloads are unmasked as 32-bit words; a writable buffer
+    such as a bytearray is unmasked in place and returned as a memoryview
+    without copying. Otherwise the whole payload is XORed as one big integer.
+    """
+    length = len(data)
+    if not length:
+        return data
+    if numpy is not None and length >= NUMPY_MIN_LENGTH:
+        payload = numpy.frombuffer(data, dtype=numpy.uint8)
+        if not payload.flags.writeable:
+            payload = payload.copy()
+        words = length // 4
+        if words:
+            key = numpy.frombuffer(bytes(mask), dtype=numpy.uint32)[0]
+            aligned = payload[:words * 4].view(numpy.uint32)
+            numpy.bitwise_xor(aligned, key, out=aligned)
+        for i in range(words * 4, length):
+            payload[i] ^= mask[i % 4]
+        return memoryview(payload)
+    if sys.version_info[0] == 3:
+        key = (bytes(mask) * (length // 4 + 1))[:length]
+        return (int.from_bytes(data, 'little') ^ int.from_bytes(key, 'little')).to_bytes(length, 'little')
+    return bytearray((b ^ mask[i % 4]) for (i, b) in enumerate(data))
+
+
+def encode_frame(opcode, data):
+    """Build an unmasked, unfragmented server frame."""
+    length = len(data)
+    out = bytearray()
+    out.append(0x80 | opcode)
+    if length <= 125:
+        out.append(length)
+    elif length <= 65535:
+        out.append(126)
+        out.extend(struct.pack('!H', length))
+    else:
+        out.append(127)
+        out.extend(struct.pack('!Q', length))
+    if length:
+        out.extend(data)
+    return out
 
 
 class BaseWebSocketHandler(BaseRequestHandler):
-    _opcodes = {
-        0: 'continue',
-        1: 'text',
-        2: 'binary',
-        8: 'close',
-        9: 'ping',
-        10: 'pong'
-    }
+    _opcodes = OPCODES
+
+    def _recv_exactly(self, length):
+        """Read exactly `length` bytes, retrying on short reads and timeouts."""
+        data = bytearray()
+        while len(data) < length:
+            try:
+                chunk = self.request.recv(length - len(data))
+            except socket.timeout:
+                if self.should_close():
+                    raise struct.error('connection closed')
+                continue
+            if not chunk:
+                raise struct.error('connection closed')
+            data.extend(chunk)
+        return data
 
     def handle(self):
         self.request.settimeout(0.01)
-        str_t = str if sys.version_info[0] == 3 else lambda a, b: str(a).encode(b)
         while not self.should_close():
             try:
                 request, headers = str_t(self.request.recv(1024), 'ascii').split('\r\n', 1)
@@ -40,21 +125,17 @@ class BaseWebSocketHandler(BaseRequestHandler):
                 continue
         headers = email.parser.HeaderParser().parsestr(headers)
         # TODO(jschwartzentruber): validate request/headers
-        hresponse = hashlib.sha1(headers['sec-websocket-key'].encode('ascii'))
-        hresponse.update(b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11')
-        resp = email.message.Message()
-        resp.add_header('Upgrade', 'websocket')
-        resp.add_header('Connection', 'Upgrade')
-        resp.add_header('Sec-WebSocket-Accept', str_t(base64.b64encode(hresponse.digest()), 'ascii'))
-        resp = resp.as_string(unixfrom=False).replace('\n', '\r\n')
-        self.request.sendall('HTTP/1.1 101 Switching Protocols\r\n{}'.format(resp).encode('ascii'))
+        self.request.sendall(handshake_response(headers))
         self.open()
         buf = None
         buf_op = None
         try:
             while not self.should_close():
                 try:
-                    data = struct.unpack('BB', self.request.recv(2))
+                    data = self.request.recv(2)
+                    if len(data) == 1:
+                        data += self._recv_exactly(1)
+                    data = struct.unpack('BB', data)
                 except socket.timeout:
                     # no data
                     #time.sleep(0.01)
@@ -71,13 +152,13 @@ class BaseWebSocketHandler(BaseRequestHandler):
                     continue
                 length = data[1] & 0x7F
                 if length == 126:
-                    length = struct.unpack('!H', self.request.recv(2))[0]
+                    length = struct.unpack('!H', self._recv_exactly(2))[0]
                 elif length == 127:
-                    length = struct.unpack('!Q', self.request.recv(8))[0]
-                mask = bytearray(self.request.recv(4)) if mask else None
-                data = bytearray(self.request.recv(length))
+                    length = struct.unpack('!Q', self._recv_exactly(8))[0]
+                mask = self._recv_exactly(4) if mask else None
+                data = self._recv_exactly(length)
                 if mask is not None:
-                    data = bytearray((b ^ mask[i % 4]) for (i, b) in enumerate(data))
+                    data = unmask(data, mask)
                 if opcode == 'continue':
                     assert buf is not None
                     opcode = buf_op
@@ -90,7 +171,9 @@ class BaseWebSocketHandler(BaseRequestHandler):
                     buf = buf_op = None
                 if opcode == 'text':
                     data = str_t(data, 'utf8')
-                elif opcode != 'binary':
+                elif opcode == 'binary':
+                    data = bytearray(data)
+                else:
                     logging.warning('Unknown websocket opcode {}'.format(opcode))
                     continue
                 if buf is None:
@@ -108,20 +191,7 @@ class BaseWebSocketHandler(BaseRequestHandler):
         pass
 
     def _send(self, opcode, data):
-        length = len(data)
-        out = bytearray()
-        out.append(0x80 | opcode)
-        if length <= 125:
-            out.append(length)
-        elif length <= 65535:
-            out.append(126)
-            out.extend(struct.pack('!H', length))
-        else:
-            out.append(127)
-            out.extend(struct.pack('!Q', length))
-        if length:
-            out.extend(data)
-        self.request.sendall(out)
+        self.request.sendall(encode_frame(opcode, data))
 
     # Below is the partial API from tornado.websocket.WebSocketHandler
     def ping(self):
@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs.py.signatures import crash_signature  # noqa: E402
+
+
+REPORT = '''\
+==1234==ERROR: AddressSanitizer: heap-use-after-free on address 0x602000000010 at pc 0x7f bp 0x7f sp 0x7f
+READ of size 4 at 0x602000000010 thread T0
+    #0 0x7f0000000001 in __asan_memcpy /src/asan_interceptors.cpp:22
+    #1 0x7f0000000002 in mozilla::dom::Element::SetAttribute(int) /src/dom/Element.cpp:10:3
+    #2 0x7f0000000003 in nsINode::AppendChild(nsINode*) /src/dom/nsINode.cpp:20:5
+    #3 0x7f0000000004 (/usr/lib/libxul.so+0x1234)
+    #4 0x7f0000000005 in js::RunScript(JSContext*) /src/js/Interpreter.cpp:30:1
+
+0x602000000010 is located 0 bytes inside of 4-byte region
+freed by thread T0 here:
+    #0 0x7f0000000011 in free /src/asan_malloc_linux.cpp:5
+    #1 0x7f0000000012 in mozilla::dom::Element::Remove() /src/dom/Element.cpp:99:1
+
+SUMMARY: AddressSanitizer: heap-use-after-free /src/dom/Element.cpp:10:3
+'''
+
+
+class CrashSignatureTest(unittest.TestCase):
+
+    def test_first_stack(self):
+        signature, description = crash_signature(REPORT.splitlines())
+        self.assertEqual(description, 'heap-use-after-free READ: mozilla::dom::Element::SetAttribute(int) | '
+                                      'nsINode::AppendChild(nsINode*) | libxul.so | js::RunScript(JSContext*)')
+        self.assertEqual(len(signature), 40)
+
+    def test_interleaved_console_output(self):
+        lines = REPORT.splitlines()
+        lines.insert(4, '/*L*/ o1.setAttribute("id", "a");')
+        lines.insert(6, 'JavaScript error: index.html, line 1: TypeError: o2 is null')
+        self.assertEqual(crash_signature(lines), crash_signature(REPORT.splitlines()))
+
+    def test_frames(self):
+        _, description = crash_signature(REPORT.splitlines(), frames=2)
+        self.assertEqual(description, 'heap-use-after-free READ: mozilla::dom::Element::SetAttribute(int) | '
+                                      'nsINode::AppendChild(nsINode*)')
+
+    def test_no_report(self):
+        self.assertEqual(crash_signature(['Hello', '#0 0x1 in foo /a.c:1']), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()